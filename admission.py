@@ -0,0 +1,111 @@
+import os
+import shutil
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Iterable, Optional
+
+from config import (
+    DOWNLOAD_DIR, DOWNLOAD_BUDGET_MB, DOWNLOAD_HARD_LIMIT_MB, DOWNLOAD_MIN_FREE_MB, DOWNLOAD_QUEUE_TIMEOUT
+)
+from progress import format_size
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# 大小未知的媒体按该值预留
+UNKNOWN_SIZE_ESTIMATE = 50 * MB
+
+
+class AdmissionRejected(Exception):
+    """下载请求被拒绝（超过大小上限、磁盘空间不足或排队超时）"""
+
+
+class DownloadAdmission:
+    """下载准入控制
+
+    下载前按媒体已知大小预留字节数：超过单文件上限或磁盘放不下的请求立即拒绝；
+    超出全局在途字节预算的请求排队等待，直到其他下载释放预留。
+    没有其他下载在途时，大于预算但未超过上限的单个文件也允许下载。
+    """
+
+    def __init__(self, budget: int = DOWNLOAD_BUDGET_MB * MB, hard_limit: int = DOWNLOAD_HARD_LIMIT_MB * MB,
+                 min_free: int = DOWNLOAD_MIN_FREE_MB * MB, queue_timeout: float = DOWNLOAD_QUEUE_TIMEOUT,
+                 path: str = DOWNLOAD_DIR):
+        self.budget = budget
+        self.hard_limit = hard_limit
+        self.min_free = min_free
+        self.queue_timeout = queue_timeout
+        self.path = path
+        self.in_flight = 0
+        self.waiting = 0
+        self.condition = asyncio.Condition()
+
+    @staticmethod
+    def estimate(sizes: Iterable[Optional[int]]) -> int:
+        """估算需要预留的字节数，未知大小按默认值计算"""
+        return sum(size if size else UNKNOWN_SIZE_ESTIMATE for size in sizes)
+
+    def free_space(self) -> int:
+        """下载目录所在磁盘的剩余空间"""
+        path = self.path if os.path.exists(self.path) else "."
+        return shutil.disk_usage(path).free
+
+    def check(self, size: int, largest: Optional[int] = None):
+        """快速拒绝不可能被满足的请求
+
+        单文件上限针对最大的那个文件（largest，默认等于 size），相册整组只检查磁盘空间
+        """
+        largest = size if largest is None else largest
+        if largest > self.hard_limit:
+            raise AdmissionRejected(
+                f"文件过大（{format_size(largest)}），超过下载上限 {format_size(self.hard_limit)}"
+            )
+        if size + self.min_free > self.free_space():
+            raise AdmissionRejected(f"磁盘空间不足，无法下载 {format_size(size)} 的文件")
+
+    def can_admit(self, size: int) -> bool:
+        """在途字节和磁盘剩余空间是否允许再预留 size 字节"""
+        # 已预留但尚未写入磁盘的字节也要从剩余空间中扣除
+        if self.free_space() - self.in_flight < size + self.min_free:
+            return False
+        return self.in_flight == 0 or self.in_flight + size <= self.budget
+
+    @asynccontextmanager
+    async def reserve(self, size: int, on_queue: Optional[Callable[[], Awaitable]] = None,
+                      largest: Optional[int] = None):
+        """预留 size 字节，退出时释放；需要排队时先调用 on_queue 通知用户
+
+        一次预留多个文件时用 largest 传入其中最大的单个文件大小
+        """
+        self.check(size, largest)
+
+        async with self.condition:
+            admitted = self.can_admit(size)
+            if admitted:
+                self.in_flight += size
+
+        if not admitted:
+            logger.info("下载排队: 需要 %s，在途 %s", format_size(size), format_size(self.in_flight))
+            # 通知用户是一次网络调用，在锁外进行，不阻塞其他预留和释放
+            if on_queue:
+                await on_queue()
+            async with self.condition:
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(
+                        self.condition.wait_for(lambda: self.can_admit(size)),
+                        timeout=self.queue_timeout
+                    )
+                except asyncio.TimeoutError:
+                    raise AdmissionRejected("下载队列繁忙，排队超时，请稍后重试")
+                finally:
+                    self.waiting -= 1
+                self.in_flight += size
+
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.in_flight -= size
+                self.condition.notify_all()
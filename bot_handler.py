@@ -1,14 +1,64 @@
+import os
 import asyncio
 import logging
+from functools import partial
+from contextlib import AsyncExitStack
+from typing import Optional, Tuple
 from pyrogram import Client, filters
-from pyrogram.types import Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
-from message_extractor import MessageExtractor
-from config import API_ID, API_HASH, BOT_TOKEN, FULL_SESSION_PATH, FULL_BOT_SESSION_PATH
+from pyrogram.enums import ChatType, ParseMode
+from pyrogram.errors import FloodWait
+from pyrogram.handlers import MessageHandler
+from pyrogram.types import (
+    Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio,
+    InlineKeyboardMarkup, InlineKeyboardButton, InlineQuery, InlineQueryResultArticle, InputTextMessageContent,
+    InlineQueryResultCachedPhoto, InlineQueryResultCachedVideo, InlineQueryResultCachedDocument,
+    InlineQueryResultCachedAudio, InlineQueryResultCachedVoice, InlineQueryResultCachedAnimation,
+    InlineQueryResultCachedSticker
+)
+from message_extractor import MessageExtractor, INVALID_LINK, NOT_FOUND, NO_ACCESS, NO_CHAT
+from progress import ProgressReporter, format_size
+from admission import DownloadAdmission
+from lifecycle import JobTracker, InstanceLock
+from logging_setup import new_trace
+from policy import run_stage, new_job_budget, stage_stats, JobAborted, DESTINATION_ERRORS
+from traffic import TrafficRecorder, note_messages, note_method
+from profiler import run_profile, ProfileBusyError
+from runtime import detect_backends, run_benchmark
+from subscriptions import SubscriptionManager
+from inline_cache import InlineMediaCache
+from config import (
+    API_ID, API_HASH, BOT_TOKEN, FULL_SESSION_PATH, FULL_BOT_SESSION_PATH, LEAN_FORWARD,
+    SUBSCRIPTIONS_FILE, FANOUT_BATCH_SIZE, FANOUT_BATCH_INTERVAL, ALBUM_COLLECT_DELAY, ADMIN_IDS,
+    DRAIN_TIMEOUT, HANDOVER_TIMEOUT, MAX_CONCURRENT_JOBS, INLINE_STORAGE_CHAT, INLINE_CACHE_FILE, INLINE_CACHE_SIZE, INLINE_CACHE_TIME,
+    INLINE_PREPARE_WAIT, INLINE_CACHE_FLUSH_INTERVAL, INLINE_DEBOUNCE
+)
 
-# 设置日志
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Telegram 文本与说明文字的长度上限
+TEXT_LIMIT = 4096
+CAPTION_LIMIT = 1024
+
+# 下载排队时显示给用户的提示
+QUEUED_TEXT = "⏳ 下载队列繁忙，排队等待中..."
+
+# 一个媒体组最多包含的媒体数量
+MEDIA_GROUP_LIMIT = 10
+
+# 支持说明文字的媒体类型
+CAPTION_MEDIA_TYPES = ("photo", "video", "document", "audio", "voice", "animation")
+
+# 链接失败原因对应的提示
+FAILURE_TEXTS = {
+    INVALID_LINK: "消息链接格式不正确",
+    NOT_FOUND: "消息不存在或已被删除",
+    NO_ACCESS: "没有权限访问该频道或群组（私有频道需要转发服务的账号先加入）",
+    NO_CHAT: "频道或群组的用户名不存在",
+}
+
+# 内联查询提示（无法获取、正在准备等）的缓存时间（秒），媒体准备好后用户重新输入即可看到结果
+INLINE_NOTICE_CACHE_TIME = 5
+
 
 class MessageExtractorBot:
     """消息提取Bot处理器"""
@@ -21,7 +71,31 @@ class MessageExtractorBot:
             bot_token=BOT_TOKEN
         )
         self.extractor = MessageExtractor(API_ID, API_HASH, FULL_SESSION_PATH)
+        self.subscriptions = SubscriptionManager(SUBSCRIPTIONS_FILE)
+        # 内联模式：Bot 自己的 file_id 缓存，以及正在上传到存储聊天的任务 {file_unique_id: Task}
+        self.inline_cache = InlineMediaCache(INLINE_CACHE_FILE, INLINE_CACHE_SIZE)
+        self.inline_uploads = {}
+        # 每个用户最新的内联查询ID {user_id: inline_query_id}，用于丢弃输入过程中的中间查询
+        self.inline_latest = {}
+        # 定期把内联缓存的修改写入文件的后台任务
+        self.cache_flusher = None
+        # 下载回退路径的准入控制（单文件上限、磁盘空间、全局在途字节预算）
+        self.admission = DownloadAdmission()
+        # 优雅停止：进行中的任务、实例锁与停止信号
+        self.jobs = JobTracker()
+        # 链接请求在独立任务中处理，用信号量保持与处理器工作协程数相当的并发上限
+        self.job_slots = asyncio.Semaphore(MAX_CONCURRENT_JOBS or self.bot.workers)
+        self.instance_lock = InstanceLock()
+        # 可选的匿名流量录制（TRAFFIC_RECORD_FILE）
+        self.recorder = TrafficRecorder()
+        self.shutdown_event = asyncio.Event()
+        self.running = False
+        self.draining = False
+        # 正在收集的频道相册 {(频道ID, media_group_id): [Message]}
+        self.pending_albums = {}
+        self.background_tasks = set()
         self.setup_handlers()
+        self.setup_subscription_listener()
     
     def setup_handlers(self):
         """设置消息处理器"""
@@ -50,6 +124,9 @@ class MessageExtractorBot:
 • 贴纸、GIF动画
 • 媒体组/相册（多媒体组合）
 
+📢 **频道订阅**:
+发送 `/subscribe 频道用户名` 后，频道的新消息会自动推送给您。
+
 💡 **提示**: 请确保您有权限访问该消息所在的频道或群组。
 
 发送 /help 查看更多帮助信息。
@@ -66,12 +143,18 @@ class MessageExtractorBot:
 • `/start` - 开始使用
 • `/help` - 显示帮助信息
 • `/status` - 检查服务状态
+• `/subscribe <频道>` - 订阅频道，新消息自动推送
+• `/unsubscribe <频道>` - 取消订阅
+• `/subscriptions` - 查看已订阅的频道
 
 **使用步骤**:
 1. 复制要转发的 Telegram 消息链接
 2. 直接发送链接给我
 3. 我会将原消息完整转发给您
 
+**内联模式**:
+在任意聊天中输入 `@我的用户名 消息链接`，即可把原消息直接发到当前聊天
+
 **支持的消息类型**:
 ✅ 文本消息（保持原格式）
 ✅ 图片消息（包含说明文字）
@@ -104,11 +187,132 @@ class MessageExtractorBot:
                 else:
                     status = "❌ 消息转发服务未连接"
                 
-                await message.reply(f"🔍 **服务状态**\n\n{status}")
+                cache = self.extractor.cache
+                lookups = cache.hits + cache.misses
+                hit_rate = f"{cache.hits * 100 / lookups:.0f}%" if lookups else "-"
+                cache_status = f"📦 消息缓存: {len(cache)} 条，命中率 {hit_rate}"
+                negative_cache = self.extractor.negative_cache
+                cache_status += f"\n🚫 失败链接缓存: {len(negative_cache)} 条，已拦截 {negative_cache.hits} 次请求"
+                
+                admission = self.admission
+                download_status = (
+                    f"⬇️ 在途下载: {format_size(admission.in_flight)} / {format_size(admission.budget)}，"
+                    f"排队 {admission.waiting} 个"
+                )
+                
+                backends = detect_backends()
+                runtime_status = f"⚙️ 运行时: 加密 {backends['crypto']}，事件循环 {backends['event_loop']}"
+                
+                timeouts = "，".join(f"{stage} {stats.timeout():.0f}s" for stage, stats in stage_stats.items())
+                timeout_status = f"⏱ 阶段超时: {timeouts}"
+                
+                await message.reply(
+                    f"🔍 **服务状态**\n\n{status}\n{cache_status}\n{download_status}\n{runtime_status}\n"
+                    f"{timeout_status}"
+                )
             except Exception as e:
                 await message.reply(f"❌ 检查状态时出错: {str(e)}")
         
-        @self.bot.on_message(filters.text & ~filters.command(["start", "help", "status"]))
+        @self.bot.on_message(filters.command("profile") & filters.user(ADMIN_IDS))
+        async def profile_command(client, message: Message):
+            """性能分析命令（仅管理员）"""
+            try:
+                seconds = float(message.command[1]) if len(message.command) > 1 else 10
+            except ValueError:
+                await message.reply("用法: `/profile 秒数`（1-300）")
+                return
+            seconds = min(max(seconds, 1), 300)
+            
+            await message.reply(f"🔬 开始性能分析，持续 {seconds:.0f} 秒...")
+            try:
+                summary, report_path, stats_path = await run_profile(seconds)
+            except ProfileBusyError:
+                await message.reply("⚠️ 已有性能分析在运行，请稍后再试")
+                return
+            
+            try:
+                # 函数名中含有 < > 等字符，按纯文本发送
+                await message.reply(f"📊 性能分析报告\n\n{summary}", parse_mode=ParseMode.DISABLED)
+                await self.bot.send_media_group(
+                    chat_id=message.chat.id,
+                    media=[
+                        InputMediaDocument(report_path),
+                        InputMediaDocument(stats_path, caption="cProfile 原始数据（可用 pstats/snakeviz 打开）")
+                    ]
+                )
+            finally:
+                for path in (report_path, stats_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+        
+        @self.bot.on_message(filters.command("benchmark") & filters.user(ADMIN_IDS))
+        async def benchmark_command(client, message: Message):
+            """运行时微基准命令（仅管理员）"""
+            await message.reply("🏎 正在运行微基准...")
+            report = await run_benchmark()
+            await message.reply(f"📊 微基准结果\n\n{report}", parse_mode=ParseMode.DISABLED)
+        
+        @self.bot.on_message(filters.command("subscribe"))
+        async def subscribe_command(client, message: Message):
+            """订阅频道命令"""
+            if len(message.command) < 2:
+                await message.reply("用法: `/subscribe 频道用户名或链接`\n例如: `/subscribe @telegram`")
+                return
+            
+            try:
+                chat = await self.resolve_channel(message.command[1])
+            except Exception as e:
+                await message.reply(f"❌ 无法访问该频道: {str(e)}")
+                return
+            
+            if chat.type != ChatType.CHANNEL:
+                await message.reply("❌ 只支持订阅频道")
+                return
+            
+            title = chat.title or str(chat.id)
+            if self.subscriptions.subscribe(chat.id, title, message.chat.id):
+                await message.reply(
+                    f"✅ 已订阅 **{title}**\n\n"
+                    "频道的新消息会自动推送给您。\n"
+                    "⚠️ 转发服务的用户账号需要已加入该频道才能收到新消息。"
+                )
+                logger.info("用户 %s 订阅频道 %s", message.chat.id, chat.id)
+            else:
+                await message.reply(f"ℹ️ 您已经订阅了 **{title}**")
+        
+        @self.bot.on_message(filters.command("unsubscribe"))
+        async def unsubscribe_command(client, message: Message):
+            """取消订阅命令"""
+            if len(message.command) < 2:
+                await message.reply("用法: `/unsubscribe 频道用户名或链接`")
+                return
+            
+            try:
+                chat = await self.resolve_channel(message.command[1])
+            except Exception as e:
+                await message.reply(f"❌ 无法访问该频道: {str(e)}")
+                return
+            
+            if self.subscriptions.unsubscribe(chat.id, message.chat.id):
+                await message.reply(f"✅ 已取消订阅 **{chat.title or chat.id}**")
+                logger.info("用户 %s 取消订阅频道 %s", message.chat.id, chat.id)
+            else:
+                await message.reply("ℹ️ 您没有订阅该频道")
+        
+        @self.bot.on_message(filters.command("subscriptions"))
+        async def subscriptions_command(client, message: Message):
+            """查看订阅列表命令"""
+            channels = self.subscriptions.user_subscriptions(message.chat.id)
+            if not channels:
+                await message.reply("📭 您还没有订阅任何频道")
+                return
+            
+            lines = [f"• {title} (`{channel_id}`)" for channel_id, title in channels]
+            await message.reply("📢 **已订阅的频道**\n\n" + "\n".join(lines))
+        
+        @self.bot.on_message(filters.text & ~filters.command(
+            ["start", "help", "status", "profile", "benchmark", "subscribe", "unsubscribe", "subscriptions"]
+        ))
         async def handle_message_link(client, message: Message):
             """处理消息链接"""
             text = message.text.strip()
@@ -124,252 +328,471 @@ class MessageExtractorBot:
                 )
                 return
             
-            # 发送处理中消息
-            processing_msg = await message.reply("🔄 正在获取消息信息，请稍候...")
+            if self.draining:
+                # 正在停止：保存请求，交给下一个实例处理
+                self.jobs.defer({"chat_id": message.chat.id, "message_id": message.id, "processing_message_id": None})
+                await message.reply("⏳ 服务正在重启，您的请求已保存，重启后会自动处理")
+                return
+            
+            # 到达时开始录制（未开启时为 None）
+            record = self.recorder.begin(
+                message.from_user.id if message.from_user else None, self.extractor.parse_message_link(text)
+            )
+            self.spawn_job(message, text, record)
+        
+        @self.bot.on_inline_query()
+        async def inline_query_handler(client, inline_query: InlineQuery):
+            """内联模式：@bot <消息链接>"""
+            await self.spawn_background(self.answer_inline_query(inline_query))
+    
+    def spawn_background(self, coro) -> asyncio.Task:
+        """在独立任务中运行推送、内联查询等后台工作，并登记到 background_tasks
+        
+        任务创建时复制上下文，任务中设置的追踪ID、采样标记和重试预算
+        不会留在处理器的上下文中，影响同一工作协程之后处理的更新
+        """
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+    
+    def spawn_job(self, message: Message, text: str, record: dict = None) -> asyncio.Task:
+        """在独立任务中处理链接请求，并登记到 JobTracker 以便优雅停止时等待或取消"""
+        job = {"chat_id": message.chat.id, "message_id": message.id, "processing_message_id": None}
+        task = asyncio.create_task(self.process_link(message, text, job, record))
+        job_id = self.jobs.start(job, task)
+        task.add_done_callback(lambda _: self.jobs.finish(job_id))
+        return task
+    
+    async def process_link(self, message: Message, text: str, job: dict, record: dict = None):
+        """处理一条消息链接请求（超过并发上限时排队等待）"""
+        async with self.job_slots:
+            trace_id = new_trace()
+            new_job_budget()
+            self.recorder.attach(record)
+            processing_msg = None
+            outcome = "error"
             
             try:
+                # 精简模式下先不发送处理中消息，只有进入慢速转发路径时才提示
+                if not LEAN_FORWARD:
+                    processing_msg = await self.update_processing_message(
+                        message, processing_msg, "🔄 正在获取消息信息，请稍候...", job
+                    )
+                
                 # 确保提取器已初始化
                 if not self.extractor.client or not self.extractor.client.is_connected:
                     await self.extractor.initialize()
                 
                 # 获取原始消息对象（可能是媒体组）
-                logger.info(f"开始获取消息，链接: {text}")
-                messages_to_forward = await self.extractor.get_media_group_messages(text)
-                logger.info(f"获取到消息数量: {len(messages_to_forward) if messages_to_forward else 0}")
+                logger.info("开始获取消息，链接: %s", text)
+                messages_to_forward = await self.extractor.get_media_group_messages(
+                    text, user_id=message.from_user.id if message.from_user else None
+                )
+                logger.info("获取到消息数量: %s", len(messages_to_forward) if messages_to_forward else 0)
+                note_messages(messages_to_forward)
                 
                 if messages_to_forward:
+                    # 精简模式：一次调用完成复制，成功后只需删除用户消息
+                    sent = await self.lean_forward(message.chat.id, messages_to_forward, text) if LEAN_FORWARD else None
+                    if sent:
+                        outcome = "ok"
+                        # Bot 发出的消息带有 Bot 自己的 file_id，顺便记下供内联模式使用
+                        self.inline_cache.remember(sent)
+                        await self.delete_messages_quietly(message.chat.id, [message.id])
+                        logger.info("成功为用户 %s 精简转发消息", message.from_user.id)
+                        return
+                    
                     # 转发消息（可能是多条）
                     if len(messages_to_forward) > 1:
-                        logger.info(f"检测到媒体组，包含 {len(messages_to_forward)} 条消息")
+                        logger.info("检测到媒体组，包含 %s 条消息", len(messages_to_forward))
                         # 更新处理消息
-                        await processing_msg.edit(f"📸 检测到媒体组（{len(messages_to_forward)} 个文件），正在合并转发...")
-                        await self.forward_media_group(message.chat.id, messages_to_forward, text)
-                        # 转发成功后删除处理消息和用户消息
-                        try:
-                            await processing_msg.delete()
-                            await message.delete()
-                        except:
-                            pass
+                        processing_msg = await self.update_processing_message(
+                            message, processing_msg,
+                            f"📸 检测到媒体组（{len(messages_to_forward)} 个文件），正在合并转发...",
+                            job
+                        )
+                        sent = await self.forward_media_group(
+                            message.chat.id, messages_to_forward, text, ProgressReporter(processing_msg)
+                        )
                     else:
                         logger.info("转发单条消息")
-                        await processing_msg.edit("🔄 正在转发消息...")
-                        await self.forward_original_message(message.chat.id, messages_to_forward[0], text)
-                        # 转发成功后删除处理消息和用户消息
-                        try:
-                            await processing_msg.delete()
-                            await message.delete()
-                        except:
-                            pass
+                        processing_msg = await self.update_processing_message(
+                            message, processing_msg, "🔄 正在转发消息...", job
+                        )
+                        sent = await self.forward_original_message(
+                            message.chat.id, messages_to_forward[0], text, ProgressReporter(processing_msg)
+                        )
                     
-                    logger.info(f"成功为用户 {message.from_user.id} 转发消息")
+                    # 转发成功后一次性删除处理消息和用户消息
+                    outcome = "ok"
+                    # 下载重传得到的 file_id 同样记下，之后的内联查询无需再次上传
+                    self.inline_cache.remember(sent or [])
+                    await self.delete_messages_quietly(message.chat.id, [processing_msg.id, message.id])
+                    
+                    logger.info("成功为用户 %s 转发消息", message.from_user.id)
                 else:
-                    await processing_msg.edit(
-                        "❌ **转发失败**\n\n"
-                        "可能的原因:\n"
-                        "• 消息链接格式不正确\n"
-                        "• 消息不存在或已被删除\n"
-                        "• 没有权限访问该消息\n"
-                        "• 频道或群组是私有的\n\n"
-                        "请检查链接是否正确，并确保您有权限访问该消息。"
-                    )
-                    logger.warning(f"用户 {message.from_user.id} 的消息转发失败: {text}")
+                    outcome = "not_found"
+                    # 负缓存中有明确原因时直接说明，否则列出可能的原因
+                    reason = self.extractor.failure_reason(text)
+                    if reason:
+                        failure_text = f"❌ **转发失败**\n\n{FAILURE_TEXTS[reason]}"
+                    else:
+                        failure_text = (
+                            "❌ **转发失败**\n\n"
+                            "可能的原因:\n"
+                            "• 消息链接格式不正确\n"
+                            "• 消息不存在或已被删除\n"
+                            "• 没有权限访问该消息\n"
+                            "• 频道或群组是私有的\n\n"
+                            "请检查链接是否正确，并确保您有权限访问该消息。"
+                        )
+                    processing_msg = await self.update_processing_message(message, processing_msg, failure_text, job)
+                    logger.warning("用户 %s 的消息转发失败（%s）: %s", message.from_user.id, reason, text)
                 
+            except JobAborted as e:
+                # 目标聊天不可达或被限流，尽力提示一次，失败时忽略
+                outcome = "aborted"
+                logger.warning("任务中止: %s", e)
+                try:
+                    await self.update_processing_message(
+                        message, processing_msg, f"❌ **转发中止**\n\n{e}\n追踪ID: `{trace_id}`", job
+                    )
+                except Exception:
+                    pass
             except Exception as e:
                 error_msg = (
                     "❌ **处理出错**\n\n"
-                    f"错误信息: `{str(e)}`\n\n"
+                    f"错误信息: `{str(e)}`\n"
+                    f"追踪ID: `{trace_id}`\n\n"
                     "请稍后重试，或联系管理员。"
                 )
-                await processing_msg.edit(error_msg)
-                logger.error(f"处理消息时出错: {e}", exc_info=True)
+                await self.update_processing_message(message, processing_msg, error_msg, job)
+                logger.error("处理消息时出错: %s", e, exc_info=True)
+            finally:
+                self.recorder.finish(outcome)
+    
+    async def update_processing_message(self, message: Message, processing_msg, text: str, job: dict = None):
+        """更新处理中消息，尚未发送时直接回复用户（并记录到任务中）"""
+        if processing_msg:
+            await processing_msg.edit(text)
+            return processing_msg
+        processing_msg = await message.reply(text)
+        if job is not None:
+            job["processing_message_id"] = processing_msg.id
+        return processing_msg
+    
+    async def delete_messages_quietly(self, chat_id: int, message_ids: list):
+        """批量删除消息，一次 API 调用，失败时忽略"""
+        try:
+            await self.bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+        except Exception as e:
+            logger.warning("删除消息失败: %s", e)
+    
+    @staticmethod
+    def normalize_link(link: str) -> str:
+        """确保链接带有协议前缀"""
+        return link if link.startswith('http') else f"https://{link}"
+    
+    def build_link_text(self, original_link: str = None) -> str:
+        """生成附加在消息末尾的原始链接文本"""
+        if not original_link:
+            return ""
+        return f"\n\n[原始消息]({self.normalize_link(original_link)})"
+    
+    @staticmethod
+    def append_link(body: str, link_text: str) -> str:
+        """把原始链接追加到正文或说明文字后面"""
+        return f"{body}{link_text}" if body else link_text.strip()
+    
+    async def lean_forward(self, chat_id: int, messages: list, original_link: str = None) -> Optional[list]:
+        """精简转发：一次 API 调用复制消息或相册，原始链接直接写入说明文字
+        
+        返回发送出的消息列表；返回 None 时由调用方回退到常规转发流程
+        """
+        link_text = self.build_link_text(original_link)
+        first = messages[0]
+        
+        try:
+            if len(messages) > 1:
+                # 相册：copy_media_group 一次复制全部，链接附加在带说明文字的那一项上
+                captions = [""] * len(messages)
+                caption_index = next((i for i, msg in enumerate(messages) if msg.caption), 0)
+                captions[caption_index] = self.append_link(messages[caption_index].caption or "", link_text)
+                if len(captions[caption_index]) > CAPTION_LIMIT:
+                    return None
+                
+                sent = await run_stage(
+                    "copy", self.bot.copy_media_group,
+                    chat_id=chat_id,
+                    from_chat_id=first.chat_id,
+                    message_id=first.message_id,
+                    captions=captions
+                )
+                logger.info("使用 Bot copy_media_group 精简转发成功")
+            
+            elif first.text:
+                # 纯文本无法通过 copy_message 修改内容，直接发送带链接的文本
+                text = self.append_link(first.text, link_text)
+                if len(text) > TEXT_LIMIT:
+                    return None
+                
+                sent = await run_stage(
+                    "send", self.bot.send_message,
+                    chat_id=chat_id,
+                    text=text,
+                    disable_web_page_preview=True
+                )
+                logger.info("使用 Bot send_message 精简转发成功")
+            
+            elif first.media in CAPTION_MEDIA_TYPES:
+                caption = self.append_link(first.caption or "", link_text)
+                if len(caption) > CAPTION_LIMIT:
+                    return None
+                
+                sent = await run_stage(
+                    "copy", self.bot.copy_message,
+                    chat_id=chat_id,
+                    from_chat_id=first.chat_id,
+                    message_id=first.message_id,
+                    caption=caption
+                )
+                logger.info("使用 Bot copy_message 精简转发成功")
+            
+            else:
+                # 贴纸、视频笔记等不支持说明文字，用内联按钮携带原始链接
+                reply_markup = None
+                if original_link:
+                    reply_markup = InlineKeyboardMarkup([
+                        [InlineKeyboardButton("原始消息", url=self.normalize_link(original_link))]
+                    ])
+                
+                sent = await run_stage(
+                    "copy", self.bot.copy_message,
+                    chat_id=chat_id,
+                    from_chat_id=first.chat_id,
+                    message_id=first.message_id,
+                    reply_markup=reply_markup
+                )
+                logger.info("使用 Bot copy_message 精简转发成功（链接按钮）")
+            
+            note_method("lean")
+            return sent if isinstance(sent, list) else [sent]
+        except Exception as e:
+            logger.warning("精简转发失败，回退到常规流程: %s", e)
+            return None
     
-    async def forward_original_message(self, chat_id: int, original_message, original_link: str = None):
-        """原样转发消息"""
+    async def forward_original_message(self, chat_id: int, original_message, original_link: str = None,
+                                       reporter: ProgressReporter = None) -> Optional[list]:
+        """原样转发消息，返回 Bot 发出的消息列表（含单独发送的链接消息），失败时返回 None"""
         try:
-            logger.info(f"开始转发消息到聊天 {chat_id}")
+            logger.info("开始转发消息到聊天 %s", chat_id)
             
             # 检查消息是否有效
             if not original_message:
                 logger.error("原始消息为空，无法转发")
-                await self.bot.send_message(
+                await run_stage(
+                    "send", self.bot.send_message,
                     chat_id=chat_id,
                     text="❌ 无法获取原始消息，可能消息已被删除或无权限访问"
                 )
                 return
             
-            logger.info(f"消息类型: text={bool(original_message.text)}, photo={bool(original_message.photo)}, video={bool(original_message.video)}")
-            logger.info(f"原始消息来源: chat_id={original_message.chat.id}, message_id={original_message.id}")
+            logger.info("消息类型: text=%s, media=%s", bool(original_message.text), original_message.media)
+            logger.info("原始消息来源: chat_id=%s, message_id=%s", original_message.chat_id, original_message.message_id)
             
             # 创建原始链接文本
-            link_text = ""
-            if original_link:
-                # 确保链接格式正确
-                if not original_link.startswith('http'):
-                    original_link = f"https://{original_link}"
-                link_text = f"\n\n[原始消息]({original_link})"
-                logger.info(f"添加原始链接: {original_link}")
+            link_text = self.build_link_text(original_link)
+            if link_text:
+                logger.info("添加原始链接: %s", self.normalize_link(original_link))
             
             # 方法1: 尝试直接使用 Bot 的 copy_message，然后发送链接
             try:
                 # 注意：这里改为使用 self.bot 而不是 self.extractor.client
-                copied_msg = await self.bot.copy_message(
+                sent = [await run_stage(
+                    "copy", self.bot.copy_message,
                     chat_id=chat_id,
-                    from_chat_id=original_message.chat.id,
-                    message_id=original_message.id
-                )
+                    from_chat_id=original_message.chat_id,
+                    message_id=original_message.message_id
+                )]
                 
                 # 如果有原始链接，发送链接消息
                 if link_text:
-                    await self.bot.send_message(
+                    sent.append(await run_stage(
+                        "send", self.bot.send_message,
                         chat_id=chat_id,
                         text=link_text,
                         disable_web_page_preview=True
-                    )
+                    ))
                 
+                note_method("copy")
                 logger.info("使用 Bot copy_message 转发成功")
-                return
+                return sent
             except Exception as copy_error:
-                logger.warning(f"Bot copy_message 失败: {copy_error}")
+                logger.warning("Bot copy_message 失败: %s", copy_error)
                 # 继续尝试其他方法
             
-            # 方法2: 根据消息类型手动发送（改进版）
+            # 方法2: 根据消息类型手动发送（改进版），失败并已提示用户时 sent 保持为 None
+            sent = None
             if original_message.text:
                 # 纯文本消息
                 text_content = original_message.text + link_text
-                await self.bot.send_message(
+                sent = [await run_stage(
+                    "send", self.bot.send_message,
                     chat_id=chat_id,
                     text=text_content,
                     disable_web_page_preview=True
-                )
+                )]
+                note_method("text")
                 logger.info("文本消息转发成功")
             
-            elif original_message.photo:
+            elif original_message.media == "photo":
                 # 图片消息 - 使用下载重传的方式
                 try:
                     # 先尝试直接使用 file_id
                     caption = (original_message.caption or "") + link_text
-                    await self.bot.send_photo(
+                    sent = [await run_stage(
+                        "send", self.bot.send_photo,
                         chat_id=chat_id,
-                        photo=original_message.photo.file_id,
+                        photo=original_message.file_id,
                         caption=caption
-                    )
+                    )]
+                    note_method("file_id")
                     logger.info("图片消息直接转发成功")
                 except Exception as photo_error:
-                    logger.warning(f"图片直接转发失败: {photo_error}")
+                    logger.warning("图片直接转发失败: %s", photo_error)
                     # 尝试下载后重传
-                    await self.download_and_resend_media(chat_id, original_message, "photo", link_text)
+                    sent = await self.download_and_resend_media(chat_id, original_message, "photo", link_text, reporter)
             
-            elif original_message.video:
+            elif original_message.media == "video":
                 # 视频消息
                 try:
                     caption = (original_message.caption or "") + link_text
-                    await self.bot.send_video(
+                    sent = [await run_stage(
+                        "send", self.bot.send_video,
                         chat_id=chat_id,
-                        video=original_message.video.file_id,
+                        video=original_message.file_id,
                         caption=caption
-                    )
+                    )]
+                    note_method("file_id")
                     logger.info("视频消息直接转发成功")
                 except Exception as video_error:
-                    logger.warning(f"视频直接转发失败: {video_error}")
-                    await self.download_and_resend_media(chat_id, original_message, "video", link_text)
+                    logger.warning("视频直接转发失败: %s", video_error)
+                    sent = await self.download_and_resend_media(chat_id, original_message, "video", link_text, reporter)
             
-            elif original_message.document:
+            elif original_message.media == "document":
                 # 文档消息
                 try:
                     caption = (original_message.caption or "") + link_text
-                    await self.bot.send_document(
+                    sent = [await run_stage(
+                        "send", self.bot.send_document,
                         chat_id=chat_id,
-                        document=original_message.document.file_id,
+                        document=original_message.file_id,
                         caption=caption
-                    )
+                    )]
+                    note_method("file_id")
                     logger.info("文档消息直接转发成功")
                 except Exception as doc_error:
-                    logger.warning(f"文档直接转发失败: {doc_error}")
-                    await self.download_and_resend_media(chat_id, original_message, "document", link_text)
+                    logger.warning("文档直接转发失败: %s", doc_error)
+                    sent = await self.download_and_resend_media(chat_id, original_message, "document", link_text, reporter)
             
-            elif original_message.audio:
+            elif original_message.media == "audio":
                 # 音频消息
                 try:
                     caption = (original_message.caption or "") + link_text
-                    await self.bot.send_audio(
+                    sent = [await run_stage(
+                        "send", self.bot.send_audio,
                         chat_id=chat_id,
-                        audio=original_message.audio.file_id,
+                        audio=original_message.file_id,
                         caption=caption
-                    )
+                    )]
+                    note_method("file_id")
                     logger.info("音频消息直接转发成功")
                 except Exception as audio_error:
-                    logger.warning(f"音频直接转发失败: {audio_error}")
-                    await self.download_and_resend_media(chat_id, original_message, "audio", link_text)
+                    logger.warning("音频直接转发失败: %s", audio_error)
+                    sent = await self.download_and_resend_media(chat_id, original_message, "audio", link_text, reporter)
             
-            elif original_message.voice:
+            elif original_message.media == "voice":
                 # 语音消息
                 try:
                     caption = (original_message.caption or "") + link_text
-                    await self.bot.send_voice(
+                    sent = [await run_stage(
+                        "send", self.bot.send_voice,
                         chat_id=chat_id,
-                        voice=original_message.voice.file_id,
+                        voice=original_message.file_id,
                         caption=caption
-                    )
+                    )]
+                    note_method("file_id")
                     logger.info("语音消息直接转发成功")
                 except Exception as voice_error:
-                    logger.warning(f"语音直接转发失败: {voice_error}")
-                    await self.download_and_resend_media(chat_id, original_message, "voice", link_text)
+                    logger.warning("语音直接转发失败: %s", voice_error)
+                    sent = await self.download_and_resend_media(chat_id, original_message, "voice", link_text, reporter)
             
-            elif original_message.sticker:
+            elif original_message.media == "sticker":
                 # 贴纸消息
                 try:
-                    await self.bot.send_sticker(
+                    sent = [await run_stage(
+                        "send", self.bot.send_sticker,
                         chat_id=chat_id,
-                        sticker=original_message.sticker.file_id
-                    )
+                        sticker=original_message.file_id
+                    )]
                     # 贴纸后发送链接
                     if link_text:
-                        await self.bot.send_message(
+                        sent.append(await run_stage(
+                            "send", self.bot.send_message,
                             chat_id=chat_id,
                             text=link_text,
                             disable_web_page_preview=True
-                        )
+                        ))
+                    note_method("file_id")
                     logger.info("贴纸消息转发成功")
                 except Exception as sticker_error:
-                    logger.warning(f"贴纸转发失败: {sticker_error}")
-                    await self.bot.send_message(
+                    logger.warning("贴纸转发失败: %s", sticker_error)
+                    await run_stage(
+                        "send", self.bot.send_message,
                         chat_id=chat_id,
                         text=f"🎭 贴纸消息转发失败，可能是权限问题{link_text}",
                         disable_web_page_preview=True
                     )
             
-            elif original_message.animation:
+            elif original_message.media == "animation":
                 # GIF动画
                 try:
                     caption = (original_message.caption or "") + link_text
-                    await self.bot.send_animation(
+                    sent = [await run_stage(
+                        "send", self.bot.send_animation,
                         chat_id=chat_id,
-                        animation=original_message.animation.file_id,
+                        animation=original_message.file_id,
                         caption=caption
-                    )
+                    )]
+                    note_method("file_id")
                     logger.info("GIF动画转发成功")
                 except Exception as gif_error:
-                    logger.warning(f"GIF转发失败: {gif_error}")
-                    await self.download_and_resend_media(chat_id, original_message, "animation", link_text)
+                    logger.warning("GIF转发失败: %s", gif_error)
+                    sent = await self.download_and_resend_media(chat_id, original_message, "animation", link_text, reporter)
             
-            elif original_message.video_note:
+            elif original_message.media == "video_note":
                 # 视频笔记（圆形视频）
                 try:
-                    await self.bot.send_video_note(
+                    sent = [await run_stage(
+                        "send", self.bot.send_video_note,
                         chat_id=chat_id,
-                        video_note=original_message.video_note.file_id
-                    )
+                        video_note=original_message.file_id
+                    )]
                     # 视频笔记后发送链接
                     if link_text:
-                        await self.bot.send_message(
+                        sent.append(await run_stage(
+                            "send", self.bot.send_message,
                             chat_id=chat_id,
                             text=link_text,
                             disable_web_page_preview=True
-                        )
+                        ))
+                    note_method("file_id")
                     logger.info("视频笔记转发成功")
                 except Exception as vn_error:
-                    logger.warning(f"视频笔记转发失败: {vn_error}")
-                    await self.bot.send_message(
+                    logger.warning("视频笔记转发失败: %s", vn_error)
+                    await run_stage(
+                        "send", self.bot.send_message,
                         chat_id=chat_id,
                         text=f"📹 视频笔记转发失败，可能是权限问题{link_text}",
                         disable_web_page_preview=True
@@ -378,235 +801,371 @@ class MessageExtractorBot:
             else:
                 # 其他类型或空消息
                 logger.warning("未知消息类型或空消息")
-                await self.bot.send_message(
+                await run_stage(
+                    "send", self.bot.send_message,
                     chat_id=chat_id,
                     text="⚠️ 该消息类型暂不支持转发，或消息为空。"
                 )
+            return sent
                 
         except Exception as e:
-            logger.error(f"转发消息时出错: {e}", exc_info=True)
-            await self.bot.send_message(
+            logger.error("转发消息时出错: %s", e, exc_info=True)
+            await run_stage(
+                "send", self.bot.send_message,
                 chat_id=chat_id,
                 text=f"❌ 转发消息时出错: {str(e)}"
             )
     
-    async def download_and_resend_media(self, chat_id: int, original_message, media_type: str, link_text: str = ""):
-        """下载媒体文件并重新发送"""
+    async def download_and_resend_media(self, chat_id: int, original_message, media_type: str, link_text: str = "",
+                                        reporter: ProgressReporter = None) -> Optional[list]:
+        """下载媒体文件并重新发送，返回 Bot 发出的消息列表，失败时返回 None"""
+        reporter = reporter or ProgressReporter()
         try:
-            logger.info(f"尝试下载并重传 {media_type} 媒体...")
-            
-            # 下载文件到临时位置
-            file_path = await self.extractor.client.download_media(original_message)
-            
-            if file_path:
-                logger.info(f"文件下载成功: {file_path}")
-                
-                # 根据类型重新发送
-                if media_type == "photo":
-                    caption = (original_message.caption or "") + link_text
-                    await self.bot.send_photo(
-                        chat_id=chat_id,
-                        photo=file_path,
-                        caption=caption
-                    )
-                elif media_type == "video":
-                    caption = (original_message.caption or "") + link_text
-                    await self.bot.send_video(
-                        chat_id=chat_id,
-                        video=file_path,
-                        caption=caption
-                    )
-                elif media_type == "document":
-                    caption = (original_message.caption or "") + link_text
-                    await self.bot.send_document(
-                        chat_id=chat_id,
-                        document=file_path,
-                        caption=caption
-                    )
-                elif media_type == "audio":
-                    caption = (original_message.caption or "") + link_text
-                    await self.bot.send_audio(
-                        chat_id=chat_id,
-                        audio=file_path,
-                        caption=caption
-                    )
-                elif media_type == "voice":
-                    caption = (original_message.caption or "") + link_text
-                    await self.bot.send_voice(
-                        chat_id=chat_id,
-                        voice=file_path,
-                        caption=caption
-                    )
-                elif media_type == "animation":
-                    caption = (original_message.caption or "") + link_text
-                    await self.bot.send_animation(
-                        chat_id=chat_id,
-                        animation=file_path,
-                        caption=caption
-                    )
-                
-                logger.info(f"{media_type} 重传成功")
+            # 按已知大小预留下载空间，超过上限或磁盘不足时立即失败
+            size = self.admission.estimate([original_message.file_size])
+            async with self.admission.reserve(size, on_queue=partial(reporter.notify, QUEUED_TEXT)):
+                logger.info("尝试下载并重传 %s 媒体...", media_type)
                 
-                # 删除临时文件
-                import os
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"临时文件已删除: {file_path}")
-            else:
-                raise Exception("文件下载失败")
+                # 下载文件到临时位置
+                download = reporter.transfer("正在下载媒体文件")
+                file_path = await self.extractor.download(original_message, progress=download.update)
+                if not file_path:
+                    raise Exception("文件下载失败")
                 
+                try:
+                    logger.info("文件下载成功: %s", file_path)
+                    download.finish()
+                    upload = reporter.transfer("正在上传媒体文件")
+                    
+                    # 根据类型重新发送
+                    if media_type == "photo":
+                        caption = (original_message.caption or "") + link_text
+                        sent = await run_stage(
+                            "upload", self.bot.send_photo, size=size,
+                            chat_id=chat_id,
+                            photo=file_path,
+                            caption=caption,
+                            progress=upload.update
+                        )
+                    elif media_type == "video":
+                        caption = (original_message.caption or "") + link_text
+                        sent = await run_stage(
+                            "upload", self.bot.send_video, size=size,
+                            chat_id=chat_id,
+                            video=file_path,
+                            caption=caption,
+                            progress=upload.update
+                        )
+                    elif media_type == "document":
+                        caption = (original_message.caption or "") + link_text
+                        sent = await run_stage(
+                            "upload", self.bot.send_document, size=size,
+                            chat_id=chat_id,
+                            document=file_path,
+                            caption=caption,
+                            progress=upload.update
+                        )
+                    elif media_type == "audio":
+                        caption = (original_message.caption or "") + link_text
+                        sent = await run_stage(
+                            "upload", self.bot.send_audio, size=size,
+                            chat_id=chat_id,
+                            audio=file_path,
+                            caption=caption,
+                            progress=upload.update
+                        )
+                    elif media_type == "voice":
+                        caption = (original_message.caption or "") + link_text
+                        sent = await run_stage(
+                            "upload", self.bot.send_voice, size=size,
+                            chat_id=chat_id,
+                            voice=file_path,
+                            caption=caption,
+                            progress=upload.update
+                        )
+                    elif media_type == "animation":
+                        caption = (original_message.caption or "") + link_text
+                        sent = await run_stage(
+                            "upload", self.bot.send_animation, size=size,
+                            chat_id=chat_id,
+                            animation=file_path,
+                            caption=caption,
+                            progress=upload.update
+                        )
+                    
+                    upload.finish()
+                    note_method("download")
+                    logger.info("%s 重传成功", media_type)
+                    return [sent]
+                finally:
+                    # 上传失败或超时也要删除临时文件，否则释放预留后文件仍占用磁盘
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                        logger.info("临时文件已删除: %s", file_path)
+                    
         except Exception as e:
-            logger.error(f"下载重传失败: {e}")
-            await self.bot.send_message(
+            logger.error("下载重传失败: %s", e)
+            await run_stage(
+                "send", self.bot.send_message,
                 chat_id=chat_id,
                 text=f"❌ 媒体文件转发失败: {str(e)}"
             )
     
-    async def download_and_send_media_group(self, chat_id: int, messages: list, link_text: str = ""):
-        """下载媒体文件并重新组合为媒体组发送"""
+    @staticmethod
+    def album_kind(record) -> Optional[str]:
+        """相册中可以合并发送的类别：图片和视频可以混合，音频、文件各自成组，其他类型只能单独发送"""
+        if record.media in ("photo", "video"):
+            return "visual"
+        if record.media in ("audio", "document"):
+            return record.media
+        return None
+    
+    def plan_album_chunks(self, messages: list) -> list:
+        """按原顺序把相册切分为可以一次发送的块，同一块内类别兼容且不超过 MEDIA_GROUP_LIMIT 项"""
+        chunks = []
+        last_kind = None
+        for record in messages:
+            kind = self.album_kind(record)
+            if chunks and kind and kind == last_kind and len(chunks[-1]) < MEDIA_GROUP_LIMIT:
+                chunks[-1].append(record)
+            else:
+                chunks.append([record])
+            last_kind = kind
+        return chunks
+    
+    def album_captions(self, messages: list, link_text: str) -> Tuple[dict, Optional[int]]:
+        """每个媒体保留自己的说明文字，原始链接附加在第一个带说明文字的媒体上
+        
+        返回 ({message_id: 说明文字}, 携带链接的消息ID)；没有链接或附加后超过长度上限时
+        消息ID 为 None，有链接时由调用方单独发送
+        """
+        captions = {record.message_id: record.caption or "" for record in messages}
+        if not link_text:
+            return captions, None
+        
+        candidates = [record for record in messages if record.media in CAPTION_MEDIA_TYPES]
+        target = next((record for record in candidates if record.caption), candidates[0] if candidates else None)
+        if target:
+            caption = self.append_link(captions[target.message_id], link_text)
+            if len(caption) <= CAPTION_LIMIT:
+                captions[target.message_id] = caption
+                return captions, target.message_id
+        return captions, None
+    
+    @staticmethod
+    def build_input_media(record, media: str, caption: str):
+        """根据来源消息类型创建媒体组中的一项，media 为 file_id 或本地路径"""
+        if record.media == "photo":
+            return InputMediaPhoto(media=media, caption=caption)
+        elif record.media == "video":
+            return InputMediaVideo(media=media, caption=caption)
+        elif record.media == "audio":
+            return InputMediaAudio(media=media, caption=caption)
+        else:
+            return InputMediaDocument(media=media, caption=caption)
+    
+    async def send_album_chunk(self, chat_id: int, chunk: list, sources: list, captions: dict,
+                               upload_size: Optional[int] = None, reporter: ProgressReporter = None) -> list:
+        """发送一块：多项用 send_media_group，单项按类型单独发送，返回 Bot 发出的消息列表
+        
+        sources 为每项的 file_id，或下载后的本地路径（此时 upload_size 为这一块的字节数）
+        """
+        stage = "send" if upload_size is None else "upload"
+        if len(chunk) == 1:
+            record = chunk[0]
+            kwargs = {}
+            if record.media in CAPTION_MEDIA_TYPES:
+                kwargs["caption"] = captions[record.message_id]
+            upload = None
+            if upload_size is not None and reporter:
+                upload = reporter.transfer("正在上传媒体文件")
+                kwargs["progress"] = upload.update
+            # send_photo(chat_id, photo)、send_video(chat_id, video) 等方法名和参数名与媒体类型一致
+            send = getattr(self.bot, f"send_{record.media}")
+            sent = await run_stage(stage, send, chat_id, sources[0], size=upload_size, **kwargs)
+            if upload:
+                upload.finish()
+            return [sent]
+        
+        media = [
+            self.build_input_media(record, source, captions[record.message_id])
+            for record, source in zip(chunk, sources)
+        ]
+        return await run_stage(stage, self.bot.send_media_group, chat_id=chat_id, media=media, size=upload_size)
+    
+    async def download_album_chunk(self, chunk: list, positions: dict, total: int,
+                                   reporter: ProgressReporter) -> Tuple[list, AsyncExitStack]:
+        """预留空间并下载一块中的全部文件
+        
+        返回 (本地路径列表, stack)；调用方发送后关闭 stack，依次删除文件并释放预留
+        """
+        stack = AsyncExitStack()
+        size = self.admission.estimate(record.file_size for record in chunk)
+        largest = max(self.admission.estimate([record.file_size]) for record in chunk)
+        await stack.enter_async_context(
+            self.admission.reserve(size, on_queue=partial(reporter.notify, QUEUED_TEXT), largest=largest)
+        )
+        paths = []
+        stack.callback(self.remove_files, paths)
         try:
-            logger.info(f"开始下载 {len(messages)} 个媒体文件...")
-            media_list = []
-            downloaded_files = []
-            
-            # 获取第一条消息的说明文字
-            first_caption = ""
-            for msg in messages:
-                if msg.caption:
-                    first_caption = msg.caption
-                    break
-            
-            for i, msg in enumerate(messages):
-                try:
-                    # 下载媒体文件
-                    file_path = await self.extractor.client.download_media(msg)
-                    
-                    if file_path:
-                        logger.info(f"文件 {i+1} 下载成功: {file_path}")
-                        downloaded_files.append(file_path)
-                        
-                        # 只在第一个媒体上添加说明文字和链接
-                        caption = (first_caption + link_text) if i == 0 else ""
-                        
-                        # 根据消息类型创建媒体项
-                        if msg.photo:
-                            media_item = InputMediaPhoto(
-                                media=file_path,
-                                caption=caption
-                            )
-                        elif msg.video:
-                            media_item = InputMediaVideo(
-                                media=file_path,
-                                caption=caption
-                            )
-                        elif msg.document:
-                            # 根据MIME类型判断
-                            if msg.document.mime_type and msg.document.mime_type.startswith('image/'):
-                                media_item = InputMediaPhoto(
-                                    media=file_path,
-                                    caption=caption
-                                )
-                            elif msg.document.mime_type and msg.document.mime_type.startswith('video/'):
-                                media_item = InputMediaVideo(
-                                    media=file_path,
-                                    caption=caption
-                                )
-                            else:
-                                media_item = InputMediaDocument(
-                                    media=file_path,
-                                    caption=caption
-                                )
-                        elif msg.audio:
-                            media_item = InputMediaAudio(
-                                media=file_path,
-                                caption=caption
-                            )
-                        else:
-                            logger.warning(f"未知媒体类型，跳过文件 {i+1}")
-                            continue
-                        
-                        media_list.append(media_item)
-                        logger.info(f"媒体项 {i+1} 准备完成: {type(media_item).__name__}")
-                        
-                    else:
-                        logger.error(f"文件 {i+1} 下载失败")
-                        
-                except Exception as download_error:
-                    logger.error(f"下载文件 {i+1} 时出错: {download_error}")
-            
-            # 发送媒体组
-            if len(media_list) > 1:
-                logger.info(f"发送媒体组，包含 {len(media_list)} 个媒体文件")
-                await self.bot.send_media_group(
-                    chat_id=chat_id,
-                    media=media_list
-                )
-                logger.info("媒体组发送成功")
-            elif len(media_list) == 1:
-                logger.info("只有一个媒体文件，单独发送")
-                # 单独发送一个媒体文件
-                media_item = media_list[0]
-                if isinstance(media_item, InputMediaPhoto):
-                    await self.bot.send_photo(
-                        chat_id=chat_id,
-                        photo=media_item.media,
-                        caption=media_item.caption
-                    )
-                elif isinstance(media_item, InputMediaVideo):
-                    await self.bot.send_video(
-                        chat_id=chat_id,
-                        video=media_item.media,
-                        caption=media_item.caption
+            for record in chunk:
+                download = reporter.transfer(f"正在下载第 {positions[record.message_id]}/{total} 个文件")
+                file_path = await self.extractor.download(record, progress=download.update)
+                if not file_path:
+                    raise Exception("文件下载失败")
+                download.finish()
+                paths.append(file_path)
+        except BaseException:
+            await stack.aclose()
+            raise
+        return paths, stack
+    
+    @staticmethod
+    def remove_files(paths: list):
+        """删除临时文件"""
+        for file_path in paths:
+            try:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                    logger.info("临时文件已删除: %s", file_path)
+            except Exception as cleanup_error:
+                logger.warning("清理临时文件失败: %s", cleanup_error)
+    
+    async def send_album_chunks(self, chat_id: int, messages: list, link_text: str = "",
+                                reporter: ProgressReporter = None) -> Tuple[str, list]:
+        """分块发送相册，返回 (实际使用的方式, Bot 发出的消息列表)
+        
+        方式为最后使用的整块发送方式（album_file_id 或 album_download），
+        全部块都只能逐条发送时为 per_message。
+        
+        每块先用 file_id 发送；某块失败后，该块及之后的块改为下载重传，
+        下载下一块与上传当前块同时进行，磁盘上最多同时存在两块的文件。
+        下载重传仍失败的块逐条发送，已发送的块不会重复发送。
+        """
+        reporter = reporter or ProgressReporter()
+        chunks = self.plan_album_chunks(messages)
+        captions, link_holder = self.album_captions(messages, link_text)
+        positions = {record.message_id: i + 1 for i, record in enumerate(messages)}
+        logger.info("相册切分为 %s 块: %s", len(chunks), [len(chunk) for chunk in chunks])
+        
+        method = "album_file_id"
+        fallback_chunks = 0
+        sent = []
+        next_download = None
+        try:
+            for i, chunk in enumerate(chunks):
+                if method == "album_file_id":
+                    try:
+                        sent += await self.send_album_chunk(
+                            chat_id, chunk, [record.file_id for record in chunk], captions
+                        )
+                        continue
+                    except Exception as e:
+                        logger.warning("第 %s/%s 块按 file_id 发送失败，改为下载重传: %s", i + 1, len(chunks), e)
+                        method = "album_download"
+                
+                if next_download is None:
+                    next_download = asyncio.create_task(
+                        self.download_album_chunk(chunk, positions, len(messages), reporter)
                     )
-                elif isinstance(media_item, InputMediaDocument):
-                    await self.bot.send_document(
-                        chat_id=chat_id,
-                        document=media_item.media,
-                        caption=media_item.caption
+                download_task, next_download = next_download, None
+                try:
+                    paths, stack = await download_task
+                except Exception as e:
+                    logger.warning("第 %s/%s 块下载失败，改为逐条转发: %s", i + 1, len(chunks), e)
+                    fallback_chunks += 1
+                    sent += await self.forward_chunk_items(
+                        chat_id, chunk, captions, link_holder, link_text, reporter=reporter
                     )
-                elif isinstance(media_item, InputMediaAudio):
-                    await self.bot.send_audio(
-                        chat_id=chat_id,
-                        audio=media_item.media,
-                        caption=media_item.caption
+                    continue
+                
+                # 当前块上传的同时下载下一块
+                if i + 1 < len(chunks):
+                    next_download = asyncio.create_task(
+                        self.download_album_chunk(chunks[i + 1], positions, len(messages), reporter)
                     )
-            else:
-                raise Exception("没有成功下载任何媒体文件")
+                async with stack:
+                    try:
+                        sent += await self.send_album_chunk(
+                            chat_id, chunk, paths, captions,
+                            upload_size=self.admission.estimate(record.file_size for record in chunk),
+                            reporter=reporter
+                        )
+                    except Exception as e:
+                        logger.warning("第 %s/%s 块上传失败，改为逐条发送: %s", i + 1, len(chunks), e)
+                        fallback_chunks += 1
+                        # 仍在 stack 内，已下载的文件直接逐个上传，不重新下载
+                        sent += await self.forward_chunk_items(
+                            chat_id, chunk, captions, link_holder, link_text, paths, reporter
+                        )
             
-            # 清理临时文件
-            import os
-            for file_path in downloaded_files:
+            if fallback_chunks == len(chunks):
+                method = "per_message"
+            if link_text and link_holder is None:
+                sent.append(await run_stage(
+                    "send", self.bot.send_message,
+                    chat_id=chat_id,
+                    text=link_text,
+                    disable_web_page_preview=True
+                ))
+            return method, sent
+        finally:
+            # 出错或被取消时，丢弃已开始的下一块下载并清理其文件
+            if next_download is not None:
+                next_download.cancel()
                 try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        logger.info(f"临时文件已删除: {file_path}")
-                except Exception as cleanup_error:
-                    logger.warning(f"清理临时文件失败: {cleanup_error}")
+                    _, stack = await next_download
+                    await stack.aclose()
+                except (asyncio.CancelledError, Exception):
+                    pass
+    
+    async def forward_chunk_items(self, chat_id: int, chunk: list, captions: dict, link_holder: Optional[int],
+                                  link_text: str, paths: list = None, reporter: ProgressReporter = None) -> list:
+        """整块发送失败时逐条发送（最后的备选方案），返回 Bot 发出的消息列表
+        
+        paths 为该块已下载的文件，按 captions 中的说明文字逐个上传；没有文件或上传仍失败的项
+        走完整转发流程，如果该项携带原始链接，随后单独发送链接
+        """
+        sent = []
+        for index, record in enumerate(chunk):
+            # 单项块的整块发送就是逐个上传，失败后不再重复同一调用
+            if paths and len(chunk) > 1:
+                try:
+                    sent += await self.send_album_chunk(
+                        chat_id, [record], [paths[index]], captions,
+                        upload_size=self.admission.estimate([record.file_size]), reporter=reporter
+                    )
+                    continue
+                except Exception as e:
+                    logger.warning("第 %s 项上传失败，改为完整转发流程: %s", index + 1, e)
             
-        except Exception as e:
-            logger.error(f"下载并发送媒体组失败: {e}")
-            raise e
+            sent += await self.forward_original_message(chat_id, record, reporter=reporter) or []
+            if link_text and record.message_id == link_holder:
+                sent.append(await run_stage(
+                    "send", self.bot.send_message,
+                    chat_id=chat_id,
+                    text=link_text,
+                    disable_web_page_preview=True
+                ))
+        return sent
     
-    async def forward_media_group(self, chat_id: int, messages: list, original_link: str = None):
-        """转发媒体组（相册）"""
+    async def forward_media_group(self, chat_id: int, messages: list, original_link: str = None,
+                                  reporter: ProgressReporter = None) -> Optional[list]:
+        """转发媒体组（相册），返回 Bot 发出的消息列表，失败时返回 None"""
         try:
-            logger.info(f"开始转发媒体组，包含 {len(messages)} 条消息")
+            logger.info("开始转发媒体组，包含 %s 条消息", len(messages))
             
             # 创建原始链接文本
-            link_text = ""
-            if original_link:
-                # 确保链接格式正确
-                if not original_link.startswith('http'):
-                    original_link = f"https://{original_link}"
-                link_text = f"\n\n[原始消息]({original_link})"
+            link_text = self.build_link_text(original_link)
             
             # 方法1: 尝试使用 Bot 的 copy_messages 批量复制，然后发送链接
             try:
-                message_ids = [msg.id for msg in messages]
-                from_chat_id = messages[0].chat.id
+                message_ids = [msg.message_id for msg in messages]
+                from_chat_id = messages[0].chat_id
                 
                 # 注意：这里改为使用 self.bot 而不是 self.extractor.client
-                await self.bot.copy_messages(
+                sent = await run_stage(
+                    "copy", self.bot.copy_messages,
                     chat_id=chat_id,
                     from_chat_id=from_chat_id,
                     message_ids=message_ids
@@ -614,159 +1173,498 @@ class MessageExtractorBot:
                 
                 # 如果有原始链接，发送链接消息
                 if link_text:
-                    await self.bot.send_message(
+                    sent.append(await run_stage(
+                        "send", self.bot.send_message,
                         chat_id=chat_id,
                         text=link_text,
                         disable_web_page_preview=True
-                    )
+                    ))
                 
+                note_method("album_copy")
                 logger.info("使用 Bot copy_messages 批量转发成功")
-                return
+                return sent
             except Exception as copy_error:
-                logger.warning(f"Bot copy_messages 批量转发失败: {copy_error}")
+                logger.warning("Bot copy_messages 批量转发失败: %s", copy_error)
                 # 继续尝试其他方法
             
-            # 方法2: 尝试发送媒体组（使用file_id）
-            try:
-                media_list = []
-                
-                # 获取第一条消息的说明文字
-                first_caption = ""
-                for msg in messages:
-                    if msg.caption:
-                        first_caption = msg.caption
-                        break
+            # 方法2: 按兼容类型分块（每块最多 10 项）发送，file_id 不可用时改为下载重传
+            method, sent = await self.send_album_chunks(chat_id, messages, link_text, reporter)
+            note_method(method)
+            logger.info("媒体组分块转发完成（%s）", method)
+            return sent
                 
-                for i, msg in enumerate(messages):
-                    media_item = None
-                    # 只在第一个媒体上添加说明文字和链接
-                    caption = (first_caption + link_text) if i == 0 else ""
-                    
-                    if msg.photo:
-                        media_item = InputMediaPhoto(
-                            media=msg.photo.file_id,
-                            caption=caption
-                        )
-                    elif msg.video:
-                        media_item = InputMediaVideo(
-                            media=msg.video.file_id,
-                            caption=caption
-                        )
-                    elif msg.document and msg.document.mime_type and msg.document.mime_type.startswith('image/'):
-                        # 将图片类型的文档作为图片处理
-                        media_item = InputMediaPhoto(
-                            media=msg.document.file_id,
-                            caption=caption
-                        )
-                    elif msg.document and msg.document.mime_type and msg.document.mime_type.startswith('video/'):
-                        # 将视频类型的文档作为视频处理
-                        media_item = InputMediaVideo(
-                            media=msg.document.file_id,
-                            caption=caption
-                        )
-                    elif msg.audio:
-                        media_item = InputMediaAudio(
-                            media=msg.audio.file_id,
-                            caption=caption
-                        )
-                    
-                    if media_item:
-                        media_list.append(media_item)
-                        logger.info(f"添加媒体项 {i+1}: {type(media_item).__name__}")
-                
-                if media_list and len(media_list) > 1:
-                    logger.info(f"准备发送媒体组，包含 {len(media_list)} 个媒体项")
-                    await self.bot.send_media_group(
-                        chat_id=chat_id,
-                        media=media_list
-                    )
-                    logger.info("使用 send_media_group 转发成功")
-                    return
-                elif len(media_list) == 1:
-                    # 只有一个媒体项，直接发送
-                    logger.info("只有一个媒体项，使用单独发送")
-                    await self.forward_original_message(chat_id, messages[0])
+        except Exception as e:
+            logger.error("媒体组转发失败: %s", e)
+            await run_stage(
+                "send", self.bot.send_message,
+                chat_id=chat_id,
+                text=f"❌ 媒体组转发失败: {str(e)}"
+            )
+    
+    async def answer_inline_query(self, inline_query: InlineQuery):
+        """用 Bot 自己的 file_id 回答内联查询，尚未缓存的媒体先上传到存储聊天"""
+        query = inline_query.query.strip()
+        user_id = inline_query.from_user.id if inline_query.from_user else None
+        if "t.me" not in query:
+            # 用户删掉了链接，之前仍在等待的查询也一并作废
+            self.inline_latest.pop(user_id, None)
+            await inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+            return
+        
+        self.inline_latest[user_id] = inline_query.id
+        new_trace("inline-")
+        new_job_budget()
+        try:
+            # 用户边输入边产生查询，"t.me/chan/1" 可能只是 "t.me/chan/123" 的前缀，
+            # 停顿后仍是最新的查询才解析，避免为中间链接请求 API 和上传媒体
+            await asyncio.sleep(INLINE_DEBOUNCE)
+            if self.inline_superseded(user_id, inline_query):
+                return
+            
+            messages = await self.extractor.get_media_group_messages(query, user_id=user_id)
+            if not messages:
+                reason = self.extractor.failure_reason(query)
+                description = FAILURE_TEXTS[reason] if reason else "消息不存在、已被删除或没有权限访问"
+                await inline_query.answer(
+                    [self.inline_notice(query, "❌ 无法获取该消息", description)],
+                    cache_time=INLINE_NOTICE_CACHE_TIME
+                )
+                return
+            
+            pending = self.inline_cache.missing(messages)
+            if pending and INLINE_STORAGE_CHAT:
+                # 解析期间用户又修改了链接，不再为这条查询上传
+                if self.inline_superseded(user_id, inline_query):
                     return
+                await self.prepare_inline_media(pending)
+                pending = self.inline_cache.missing(messages)
+            
+            results = self.build_inline_results(messages, query)
+            cache_time = INLINE_CACHE_TIME
+            if pending:
+                # 结果不完整时不能长时间缓存，否则其余媒体准备好后用户也看不到
+                cache_time = INLINE_NOTICE_CACHE_TIME
+                if INLINE_STORAGE_CHAT:
+                    results.append(self.inline_notice(query, "⏳ 媒体正在准备", "请几秒后重新输入链接"))
                 else:
-                    raise Exception("无法创建媒体列表")
-                    
-            except Exception as media_group_error:
-                logger.warning(f"send_media_group 转发失败: {media_group_error}")
-                # 尝试下载重传的媒体组方法
+                    results.append(self.inline_notice(query, "⚠️ 媒体尚未缓存", "请先私聊发送该链接给 Bot"))
+            elif not results:
+                results.append(self.inline_notice(query, "⚠️ 该消息类型不支持内联发送", "请私聊发送该链接给 Bot"))
+            
+            await inline_query.answer(results, cache_time=cache_time)
+            logger.info("内联查询已回答: %s 个结果，%s 个媒体待准备", len(results), len(pending))
+        except Exception as e:
+            logger.error("处理内联查询时出错: %s", e, exc_info=True)
+        finally:
+            if self.inline_latest.get(user_id) == inline_query.id:
+                del self.inline_latest[user_id]
+    
+    def inline_superseded(self, user_id, inline_query: InlineQuery) -> bool:
+        """同一用户是否已经发来更新的内联查询"""
+        if self.inline_latest.get(user_id) == inline_query.id:
+            return False
+        logger.debug("内联查询已被同一用户的新输入取代: %s", inline_query.query)
+        return True
+    
+    def inline_notice(self, link: str, title: str, description: str) -> InlineQueryResultArticle:
+        """提示类内联结果，选中后发送原始链接"""
+        return InlineQueryResultArticle(
+            title=title,
+            description=description,
+            input_message_content=InputTextMessageContent(self.normalize_link(link), disable_web_page_preview=True)
+        )
+    
+    def build_inline_results(self, messages: list, original_link: str) -> list:
+        """用已缓存的 file_id 生成内联结果，相册中的每个媒体是一个结果"""
+        link_text = self.build_link_text(original_link)
+        first = messages[0]
+        if len(messages) == 1 and first.text:
+            text = self.append_link(first.text, link_text)
+            return [InlineQueryResultArticle(
+                title="文本消息",
+                description=first.text[:100],
+                input_message_content=InputTextMessageContent(
+                    text if len(text) <= TEXT_LIMIT else first.text, disable_web_page_preview=True
+                )
+            )]
+        
+        results = []
+        for i, record in enumerate(messages):
+            cached = self.inline_cache.get(record.file_unique_id)
+            if not cached:
+                continue
+            
+            caption = self.append_link(record.caption or "", link_text)
+            if len(caption) > CAPTION_LIMIT:
+                caption = link_text.strip()
+            result_id = f"{record.chat_id}_{record.message_id}"
+            title = f"{i+1}/{len(messages)}" if len(messages) > 1 else "原始消息"
+            file_id = cached["file_id"]
             
-            # 方法3: 下载后重新组合媒体组发送
+            if cached["media"] == "photo":
+                results.append(InlineQueryResultCachedPhoto(photo_file_id=file_id, id=result_id, caption=caption))
+            elif cached["media"] == "video":
+                results.append(InlineQueryResultCachedVideo(
+                    video_file_id=file_id, title=f"视频 {title}", id=result_id, caption=caption
+                ))
+            elif cached["media"] == "document":
+                results.append(InlineQueryResultCachedDocument(
+                    document_file_id=file_id, title=record.file_name or f"文件 {title}", id=result_id, caption=caption
+                ))
+            elif cached["media"] == "audio":
+                results.append(InlineQueryResultCachedAudio(audio_file_id=file_id, id=result_id, caption=caption))
+            elif cached["media"] == "voice":
+                results.append(InlineQueryResultCachedVoice(
+                    voice_file_id=file_id, id=result_id, title=f"语音 {title}", caption=caption
+                ))
+            elif cached["media"] == "animation":
+                results.append(InlineQueryResultCachedAnimation(
+                    animation_file_id=file_id, id=result_id, title=f"GIF {title}", caption=caption
+                ))
+            elif cached["media"] == "sticker":
+                # 贴纸不支持说明文字，用内联按钮携带原始链接
+                results.append(InlineQueryResultCachedSticker(
+                    sticker_file_id=file_id, id=result_id,
+                    reply_markup=InlineKeyboardMarkup([
+                        [InlineKeyboardButton("原始消息", url=self.normalize_link(original_link))]
+                    ])
+                ))
+            # 视频笔记没有对应的内联结果类型，跳过
+        return results
+    
+    async def prepare_inline_media(self, records: list):
+        """把尚未缓存的媒体上传到存储聊天，最多等待 INLINE_PREPARE_WAIT 秒
+        
+        同一文件同时只有一个上传任务；超时后任务继续在后台运行，下次查询即可命中缓存
+        """
+        tasks = []
+        for record in records:
+            task = self.inline_uploads.get(record.file_unique_id)
+            if task is None:
+                task = asyncio.create_task(self.store_inline_media(record))
+                self.inline_uploads[record.file_unique_id] = task
+                task.add_done_callback(lambda _, key=record.file_unique_id: self.inline_uploads.pop(key, None))
+            tasks.append(task)
+        await asyncio.wait(tasks, timeout=INLINE_PREPARE_WAIT)
+    
+    async def store_inline_media(self, record):
+        """把一个媒体发送到存储聊天，记录 Bot 得到的 file_id"""
+        # 同一查询的各个上传任务互不影响，一个中止不会让其他上传直接失败
+        new_job_budget()
+        try:
+            try:
+                sent = await run_stage(
+                    "copy", self.bot.copy_message,
+                    chat_id=INLINE_STORAGE_CHAT,
+                    from_chat_id=record.chat_id,
+                    message_id=record.message_id
+                )
+            except Exception as copy_error:
+                logger.info("复制到存储聊天失败，改为下载后上传: %s", copy_error)
+                sent = await self.upload_to_storage(record)
+            self.inline_cache.remember([sent])
+            logger.info("内联媒体已缓存: %s", record)
+        except (Exception, JobAborted) as e:
+            logger.warning("准备内联媒体失败: %s", e)
+    
+    async def upload_to_storage(self, record):
+        """下载媒体后上传到存储聊天，返回 Bot 发出的消息"""
+        size = self.admission.estimate([record.file_size])
+        async with self.admission.reserve(size):
+            file_path = await self.extractor.download(record)
+            if not file_path:
+                raise Exception("文件下载失败")
             try:
-                logger.info("尝试下载媒体文件并重新组合发送...")
-                await self.download_and_send_media_group(chat_id, messages, link_text)
+                # send_photo(chat_id, photo)、send_video(chat_id, video) 等方法名和参数名与媒体类型一致
+                send = getattr(self.bot, f"send_{record.media}")
+                return await run_stage("upload", send, INLINE_STORAGE_CHAT, file_path, size=size)
+            finally:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+    
+    def setup_subscription_listener(self):
+        """在用户客户端上监听已订阅频道的新消息"""
+        subscribed = filters.create(
+            lambda _, __, message: bool(message.chat) and self.subscriptions.is_subscribed(message.chat.id)
+        )
+        self.extractor.add_update_handler(MessageHandler(self.on_channel_post, filters.channel & subscribed))
+    
+    async def resolve_channel(self, identifier: str):
+        """用用户客户端解析频道用户名、链接或ID"""
+        chat_id = self.extractor.parse_chat_identifier(identifier)
+        if chat_id is None:
+            raise ValueError("无法识别的频道格式")
+        
+        if not self.extractor.client or not self.extractor.client.is_connected:
+            await self.extractor.initialize()
+        return await self.extractor.client.get_chat(chat_id)
+    
+    @staticmethod
+    def build_post_link(chat, message_id: int) -> str:
+        """生成频道消息的链接"""
+        if chat.username:
+            return f"https://t.me/{chat.username}/{message_id}"
+        return f"https://t.me/c/{str(chat.id).removeprefix('-100')}/{message_id}"
+    
+    async def on_channel_post(self, client, message: Message):
+        """已订阅频道的新消息：相册先收集完整再推送"""
+        # 交接模式预热期间由旧实例负责推送
+        if not self.running:
+            return
+        
+        if message.media_group_id:
+            key = (message.chat.id, message.media_group_id)
+            if key in self.pending_albums:
+                self.pending_albums[key].append(message)
                 return
-            except Exception as download_error:
-                logger.warning(f"下载重传媒体组失败: {download_error}")
-            
-            # 方法4: 逐个转发每条消息（最后的备选方案）
-            logger.info("尝试逐个转发媒体组中的每条消息...")
-            success_count = 0
             
-            for i, msg in enumerate(messages):
-                try:
-                    # 只在第一条消息上添加原始链接
-                    msg_link = original_link if i == 0 else None
-                    await self.forward_original_message(chat_id, msg, msg_link)
-                    success_count += 1
-                    logger.info(f"媒体组消息 {i+1}/{len(messages)} 转发成功")
-                    
-                    # 添加小延迟避免频率限制
-                    if i < len(messages) - 1:
-                        await asyncio.sleep(0.5)
-                        
-                except Exception as single_error:
-                    logger.error(f"媒体组消息 {i+1} 转发失败: {single_error}")
-            
-            if success_count > 0:
-                logger.info(f"媒体组转发完成，成功 {success_count}/{len(messages)} 条消息")
+            self.pending_albums[key] = [message]
+            self.spawn_background(self.flush_album(key))
+            return
+        
+        await self.spawn_background(self.deliver_channel_post([message]))
+    
+    async def flush_album(self, key: tuple):
+        """等待相册的其余消息到达后推送"""
+        await asyncio.sleep(ALBUM_COLLECT_DELAY)
+        messages = sorted(self.pending_albums.pop(key, []), key=lambda x: x.id)
+        if messages:
+            await self.deliver_channel_post(messages)
+    
+    async def deliver_channel_post(self, messages: list):
+        """解析一次频道新消息并推送给全部订阅者"""
+        new_trace("push-")
+        chat = messages[0].chat
+        subscribers = sorted(self.subscriptions.subscribers(chat.id))
+        if not subscribers:
+            return
+        
+        try:
+            link = self.build_post_link(chat, messages[0].id)
+            records = self.extractor.cache_messages(messages)
+            logger.info("频道 %s 新消息 %s，推送给 %s 个订阅者", chat.id, messages[0].id, len(subscribers))
+            await self.fan_out(records, link, subscribers)
+        except (Exception, JobAborted) as e:
+            logger.error("推送频道消息失败: %s", e, exc_info=True)
+    
+    async def fan_out(self, records: list, link: str, subscribers: list):
+        """分批推送给订阅者
+        
+        先发给第一个订阅者：能精简转发时一次复制，否则走一次完整转发流程（下载、上传）。
+        其余订阅者从这份 Bot 自己发出的副本复制，每条消息只需解析和上传一次；
+        每批之间等待一段时间以遵守频率限制。第一个订阅者不可达时改由下一个订阅者作为复制来源
+        """
+        for index, subscriber in enumerate(subscribers):
+            # 每个订阅者使用独立的重试预算，一个订阅者中止不影响其他订阅者
+            new_job_budget()
+            try:
+                sent = await self.lean_forward(subscriber, records, link)
+                if not sent:
+                    # Bot 无法直接复制源频道
+                    sent = await self.forward_to_subscriber(subscriber, records, link)
+            except JobAborted as e:
+                self.handle_subscriber_abort(subscriber, e)
+                continue
+            source, rest = subscriber, subscribers[index + 1:]
+            break
+        else:
+            logger.warning("全部 %s 个订阅者都无法推送", len(subscribers))
+            return
+        
+        if not sent:
+            logger.warning("推送给订阅者 %s 失败，没有可复制的副本，跳过其余 %s 个订阅者", source, len(rest))
+            return
+        self.inline_cache.remember(sent)
+        
+        for i in range(0, len(rest), FANOUT_BATCH_SIZE):
+            if i > 0:
+                await asyncio.sleep(FANOUT_BATCH_INTERVAL)
+            batch = rest[i:i + FANOUT_BATCH_SIZE]
+            await asyncio.gather(*[self.copy_to_subscriber(subscriber, sent) for subscriber in batch])
+    
+    def handle_subscriber_abort(self, subscriber: int, error: JobAborted):
+        """推送任务中止：订阅者屏蔽了 Bot 或已注销时移除其订阅"""
+        if isinstance(error.__cause__, DESTINATION_ERRORS):
+            logger.info("订阅者 %s 已不可达，移除其订阅", subscriber)
+            self.subscriptions.remove_subscriber(subscriber)
+        else:
+            logger.warning("推送给订阅者 %s 中止: %s", subscriber, error)
+    
+    @staticmethod
+    def group_sent_messages(sent: list) -> list:
+        """把 Bot 发出的消息按相册分组，相邻且 media_group_id 相同的消息为一组"""
+        groups = []
+        for msg in sent:
+            if groups and msg.media_group_id and msg.media_group_id == groups[-1][-1].media_group_id:
+                groups[-1].append(msg)
             else:
-                raise Exception("所有媒体组消息转发都失败了")
-                
+                groups.append([msg])
+        return groups
+    
+    async def copy_to_subscriber(self, subscriber: int, sent: list):
+        """从 Bot 已发出的副本复制给订阅者，相册整组复制，遇到 FloodWait 等待后重试一次"""
+        groups = self.group_sent_messages(sent)
+        for attempt in range(2):
+            try:
+                while groups:
+                    group = groups[0]
+                    if len(group) > 1:
+                        await self.bot.copy_media_group(
+                            chat_id=subscriber,
+                            from_chat_id=group[0].chat.id,
+                            message_id=group[0].id
+                        )
+                    else:
+                        await self.bot.copy_message(
+                            chat_id=subscriber,
+                            from_chat_id=group[0].chat.id,
+                            message_id=group[0].id
+                        )
+                    groups.pop(0)
+                return
+            except FloodWait as e:
+                logger.warning("推送触发频率限制，等待 %s 秒", e.value)
+                await asyncio.sleep(e.value)
+            except DESTINATION_ERRORS:
+                logger.info("订阅者 %s 已不可达，移除其订阅", subscriber)
+                self.subscriptions.remove_subscriber(subscriber)
+                return
+            except Exception as e:
+                logger.warning("推送给订阅者 %s 失败: %s", subscriber, e)
+                return
+    
+    async def forward_to_subscriber(self, subscriber: int, records: list, link: str) -> Optional[list]:
+        """用常规转发流程推送给订阅者，返回 Bot 发出的消息列表"""
+        if len(records) > 1:
+            return await self.forward_media_group(subscriber, records, link)
+        return await self.forward_original_message(subscriber, records[0], link)
+    
+    def request_shutdown(self):
+        """请求优雅停止（SIGTERM 或交接请求时调用）"""
+        if not self.shutdown_event.is_set():
+            logger.info("收到停止请求")
+            self.shutdown_event.set()
+    
+    async def resume_pending_jobs(self):
+        """继续处理上一个实例未完成的任务"""
+        jobs = self.jobs.load_pending()
+        if not jobs:
+            return
+        
+        logger.info("恢复 %s 个未完成的任务", len(jobs))
+        for job in jobs:
+            self.spawn_background(self.resume_job(job))
+    
+    async def resume_job(self, job: dict):
+        """根据保存的用户原始消息重新处理任务"""
+        try:
+            if job.get("processing_message_id"):
+                # 上一个实例留下的处理中消息已经过时
+                await self.delete_messages_quietly(job["chat_id"], [job["processing_message_id"]])
+            
+            message = await self.bot.get_messages(job["chat_id"], job["message_id"])
+            if not message or message.empty or not message.text:
+                logger.info("任务的原始消息已不存在，跳过: %s", job)
+                return
+            self.spawn_job(message, message.text.strip())
         except Exception as e:
-            logger.error(f"媒体组转发失败: {e}")
-            await self.bot.send_message(
-                chat_id=chat_id,
-                text=f"❌ 媒体组转发失败: {str(e)}"
-            )
+            logger.error("恢复任务失败: %s", e, exc_info=True)
     
-    async def start(self):
-        """启动Bot"""
+    async def start(self, handover: bool = False):
+        """启动Bot
+        
+        handover 为 True 时先预热用户客户端，再请求正在运行的旧实例交出 Bot
+        """
+        watcher = None
         try:
             # 初始化消息提取器
             await self.extractor.initialize()
             
+            if handover:
+                logger.info("交接模式：客户端已预热，等待旧实例停止")
+                await self.instance_lock.request_handover(HANDOVER_TIMEOUT)
+            
             # 启动Bot
             await self.bot.start()
+            self.running = True
+            watcher = asyncio.create_task(self.instance_lock.watch(self.request_shutdown))
+            self.cache_flusher = asyncio.create_task(self.inline_cache.run_flusher(INLINE_CACHE_FLUSH_INTERVAL))
             logger.info("消息提取Bot已启动")
             
             # 获取Bot信息
             me = await self.bot.get_me()
-            logger.info(f"Bot信息: @{me.username} ({me.first_name})")
+            logger.info("Bot信息: @%s (%s)", me.username, me.first_name)
+            
+            await self.resume_pending_jobs()
             
-            # 保持运行
-            await asyncio.Event().wait()
+            # 保持运行，直到收到停止请求
+            await self.shutdown_event.wait()
             
         except KeyboardInterrupt:
             logger.info("收到停止信号")
         except Exception as e:
-            logger.error(f"Bot启动失败: {e}", exc_info=True)
+            logger.error("Bot启动失败: %s", e, exc_info=True)
         finally:
             await self.stop()
+            if watcher:
+                watcher.cancel()
+            self.instance_lock.release()
+    
+    async def drain(self):
+        """停止接收新任务，等待进行中的任务完成，超时后保存未完成的任务"""
+        self.draining = True
+        if self.jobs.active:
+            logger.info("等待 %s 个进行中的任务完成（最长 %s 秒）", len(self.jobs.active), DRAIN_TIMEOUT)
+        
+        # 推送、恢复和内联上传等后台任务与转发任务一起等待
+        finished, _ = await asyncio.gather(
+            self.jobs.drain(DRAIN_TIMEOUT),
+            self.wait_background_tasks(DRAIN_TIMEOUT)
+        )
+        saved = self.jobs.persist()
+        if saved:
+            logger.info("已保存 %s 个未完成的任务，将由下一个实例继续处理", saved)
+        if not finished:
+            await self.jobs.cancel_active()
+    
+    def pending_background_tasks(self) -> list:
+        """尚未完成的后台任务：频道推送、任务恢复、内联查询和内联上传"""
+        tasks = list(self.background_tasks) + list(self.inline_uploads.values())
+        return [task for task in tasks if not task.done()]
+    
+    async def wait_background_tasks(self, timeout: float):
+        """等待后台任务完成，最长 timeout 秒"""
+        tasks = self.pending_background_tasks()
+        if tasks:
+            logger.info("等待 %s 个后台任务完成（最长 %s 秒）", len(tasks), timeout)
+            await asyncio.wait(tasks, timeout=timeout)
+    
+    async def cancel_background_tasks(self):
+        """取消仍在运行的后台任务并等待其退出，需在关闭客户端之前调用"""
+        tasks = self.pending_background_tasks()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
     
     async def stop(self):
-        """停止Bot"""
+        """停止Bot（先优雅排空进行中的任务）"""
         try:
+            if self.running:
+                await self.drain()
+            self.running = False
+            await self.cancel_background_tasks()
+            # 停止定期写入，最后写入一次内联缓存
+            if self.cache_flusher:
+                self.cache_flusher.cancel()
+            await self.inline_cache.flush()
+            await asyncio.to_thread(self.recorder.close)
             if self.extractor:
                 await self.extractor.close()
-            if self.bot:
+            if self.bot and self.bot.is_connected:
                 await self.bot.stop()
             logger.info("消息提取Bot已停止")
         except Exception as e:
-            logger.error(f"停止Bot时出错: {e}")
+            logger.error("停止Bot时出错: %s", e)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,60 @@
+from typing import Optional
+
+from pyrogram.types import Message
+
+# 带文件的媒体类型（对应 pyrogram MessageMediaType 的取值）
+FILE_MEDIA_TYPES = ("photo", "video", "document", "audio", "voice", "animation", "sticker", "video_note")
+
+
+class CachedMessage:
+    """转发所需的精简消息记录
+
+    只保留转发用到的字段，不持有 chat、user、entities 对象和客户端引用。
+    text/caption 以 Markdown 形式保存，原始格式实体已编码在文本中。
+    """
+
+    __slots__ = (
+        "chat_id", "message_id", "media_group_id", "media",
+        "file_id", "file_unique_id", "file_size", "mime_type", "file_name",
+        "text", "caption",
+    )
+
+    def __init__(self, chat_id: int, message_id: int, media_group_id: Optional[str] = None,
+                 media: Optional[str] = None, file_id: Optional[str] = None,
+                 file_unique_id: Optional[str] = None, file_size: Optional[int] = None,
+                 mime_type: Optional[str] = None, file_name: Optional[str] = None,
+                 text: Optional[str] = None, caption: Optional[str] = None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.media_group_id = media_group_id
+        self.media = media
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.file_name = file_name
+        self.text = text
+        self.caption = caption
+
+    @classmethod
+    def from_message(cls, message: Message) -> "CachedMessage":
+        """从 pyrogram Message 转换"""
+        media = message.media.value if message.media else None
+        media_obj = getattr(message, media, None) if media in FILE_MEDIA_TYPES else None
+
+        return cls(
+            chat_id=message.chat.id,
+            message_id=message.id,
+            media_group_id=message.media_group_id,
+            media=media,
+            file_id=getattr(media_obj, "file_id", None),
+            file_unique_id=getattr(media_obj, "file_unique_id", None),
+            file_size=getattr(media_obj, "file_size", None),
+            mime_type=getattr(media_obj, "mime_type", None),
+            file_name=getattr(media_obj, "file_name", None),
+            text=message.text.markdown if message.text else None,
+            caption=message.caption.markdown if message.caption else None,
+        )
+
+    def __repr__(self) -> str:
+        return f"CachedMessage(chat_id={self.chat_id}, message_id={self.message_id}, media={self.media})"
@@ -21,6 +21,76 @@ os.makedirs(SESSION_DIR, exist_ok=True)
 FULL_SESSION_PATH = os.path.join(SESSION_DIR, SESSION_NAME)
 FULL_BOT_SESSION_PATH = os.path.join(SESSION_DIR, BOT_SESSION_NAME)
 
+# 精简转发模式：原始链接写入说明文字、快速任务不发送处理提示、批量删除消息
+LEAN_FORWARD = os.getenv('LEAN_FORWARD', 'true').lower() in ('1', 'true', 'yes')
+
+# 加速模式：使用 uvloop 事件循环（TgCrypto 安装后由 Pyrogram 自动使用）
+ACCELERATED = os.getenv('ACCELERATED', 'true').lower() in ('1', 'true', 'yes')
+
+# 下载/上传进度消息的最小编辑间隔（秒）
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', '5'))
+
+# 已解析消息缓存
+MESSAGE_CACHE_SIZE = int(os.getenv('MESSAGE_CACHE_SIZE', '2000'))
+MESSAGE_CACHE_TTL = float(os.getenv('MESSAGE_CACHE_TTL', '600'))
+
+# 负缓存：记住不存在的消息、无权访问的聊天和不存在的用户名，过期前直接返回错误（秒）
+NEGATIVE_CACHE_SIZE = int(os.getenv('NEGATIVE_CACHE_SIZE', '5000'))
+NEGATIVE_TTL_NOT_FOUND = float(os.getenv('NEGATIVE_TTL_NOT_FOUND', '60'))
+NEGATIVE_TTL_NO_ACCESS = float(os.getenv('NEGATIVE_TTL_NO_ACCESS', '300'))
+NEGATIVE_TTL_NO_CHAT = float(os.getenv('NEGATIVE_TTL_NO_CHAT', '3600'))
+
+# 顺序阅读预取：每次预取的消息数量、延迟（秒）和每分钟最多预取调用次数
+PREFETCH_COUNT = int(os.getenv('PREFETCH_COUNT', '3'))
+PREFETCH_DELAY = float(os.getenv('PREFETCH_DELAY', '1'))
+PREFETCH_BUDGET = int(os.getenv('PREFETCH_BUDGET', '20'))
+
+# 频道订阅：订阅关系文件、推送批次大小与批次间隔（秒）、相册收集等待时间（秒）
+SUBSCRIPTIONS_FILE = os.path.join(SESSION_DIR, "subscriptions.json")
+FANOUT_BATCH_SIZE = int(os.getenv('FANOUT_BATCH_SIZE', '20'))
+FANOUT_BATCH_INTERVAL = float(os.getenv('FANOUT_BATCH_INTERVAL', '1'))
+ALBUM_COLLECT_DELAY = float(os.getenv('ALBUM_COLLECT_DELAY', '1.5'))
+
+# 管理员用户ID（逗号分隔），可使用 /profile 等管理命令
+ADMIN_IDS = [int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()]
+
+# 下载回退路径的准入控制：下载目录、全局在途预算、单文件上限、最少保留磁盘空间（MB）和排队超时（秒）
+DOWNLOAD_DIR = "downloads"
+DOWNLOAD_BUDGET_MB = int(os.getenv('DOWNLOAD_BUDGET_MB', '4096'))
+DOWNLOAD_HARD_LIMIT_MB = int(os.getenv('DOWNLOAD_HARD_LIMIT_MB', '2000'))
+DOWNLOAD_MIN_FREE_MB = int(os.getenv('DOWNLOAD_MIN_FREE_MB', '512'))
+DOWNLOAD_QUEUE_TIMEOUT = float(os.getenv('DOWNLOAD_QUEUE_TIMEOUT', '600'))
+
+# 同时处理的链接请求上限，0 表示与 Pyrogram 处理器的工作协程数相同
+MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', '0'))
+
+# 优雅停止与交接：等待进行中任务的最长时间、新实例等待旧实例交接的最长时间（秒）
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '60'))
+HANDOVER_TIMEOUT = float(os.getenv('HANDOVER_TIMEOUT', '180'))
+HANDOVER = os.getenv('HANDOVER', 'false').lower() in ('1', 'true', 'yes')
+PENDING_JOBS_FILE = os.path.join(SESSION_DIR, "pending_jobs.json")
+INSTANCE_LOCK_FILE = os.path.join(SESSION_DIR, "instance.lock")
+HANDOVER_REQUEST_FILE = os.path.join(SESSION_DIR, "handover.request")
+
+# 任务级重试预算：每个转发任务最多重试次数和累计退避/限流等待时间（秒）
+JOB_RETRY_BUDGET = int(os.getenv('JOB_RETRY_BUDGET', '3'))
+JOB_RETRY_WAIT = float(os.getenv('JOB_RETRY_WAIT', '60'))
+
+# 流量录制：每个请求的匿名记录追加到该 JSONL 文件（留空则关闭），摘要使用的盐
+TRAFFIC_RECORD_FILE = os.getenv('TRAFFIC_RECORD_FILE', '')
+TRAFFIC_SALT = os.getenv('TRAFFIC_SALT', '')
+
+# 内联模式：存储聊天ID（Bot 把尚未缓存的媒体上传到这里换取自己的 file_id，留空则不上传）、
+# file_id 缓存文件与条目上限、结果缓存时间（秒）、缓存写入文件的间隔（秒）、回答前等待上传的最长时间（秒）、
+# 同一用户连续输入时只处理停顿超过该时间（秒）的最后一次查询
+INLINE_STORAGE_CHAT = int(os.getenv('INLINE_STORAGE_CHAT')) if os.getenv('INLINE_STORAGE_CHAT') else None
+INLINE_CACHE_FILE = os.path.join(SESSION_DIR, "inline_cache.json")
+INLINE_CACHE_SIZE = int(os.getenv('INLINE_CACHE_SIZE', '10000'))
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '300'))
+INLINE_CACHE_FLUSH_INTERVAL = float(os.getenv('INLINE_CACHE_FLUSH_INTERVAL', '30'))
+INLINE_PREPARE_WAIT = float(os.getenv('INLINE_PREPARE_WAIT', '5'))
+INLINE_DEBOUNCE = float(os.getenv('INLINE_DEBOUNCE', '0.8'))
+
 # 验证配置
 if not all([API_ID, API_HASH, BOT_TOKEN]):
     raise ValueError("请在 .env 文件中设置 API_ID, API_HASH 和 BOT_TOKEN")
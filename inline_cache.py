@@ -0,0 +1,100 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from cached_message import CachedMessage
+
+logger = logging.getLogger(__name__)
+
+
+class InlineMediaCache:
+    """Bot 自己可用的 file_id 缓存，供内联查询直接引用
+
+    用户客户端拿到的 file_id 不能被 Bot 使用，但 file_unique_id 对所有账号相同，
+    因此以来源媒体的 file_unique_id 为键，保存 Bot 发送同一文件后得到的 file_id。
+    文件结构: {"file_unique_id": {"media": "photo", "file_id": "..."}}，超过 max_size 时淘汰最旧的条目。
+    remember 只在内存中修改并标记 dirty，由 run_flusher 定期、停止时由 flush 在线程中写入文件。
+    """
+
+    def __init__(self, path: str, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.dirty = False
+        # 定期写入和停止时的写入可能同时在两个线程中进行，保证依次替换文件
+        self.save_lock = threading.Lock()
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def load(self):
+        """从文件读取缓存"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = OrderedDict(json.load(f))
+            logger.info("已加载 %s 个内联媒体缓存", len(self.entries))
+        except Exception as e:
+            logger.error("读取内联媒体缓存失败: %s", e)
+
+    def save(self, entries: dict) -> bool:
+        """写入缓存文件（先写临时文件再替换，避免写一半损坏），在线程中调用"""
+        tmp_path = f"{self.path}.tmp"
+        with self.save_lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                return True
+            except Exception as e:
+                logger.error("保存内联媒体缓存失败: %s", e)
+                return False
+
+    async def flush(self):
+        """有修改时把当前缓存写入文件，磁盘操作在线程中进行，不阻塞事件循环"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        snapshot = dict(self.entries)
+        if not await asyncio.to_thread(self.save, snapshot):
+            self.dirty = True
+
+    async def run_flusher(self, interval: float):
+        """每 interval 秒写入一次修改，作为后台任务运行"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def get(self, file_unique_id: Optional[str]) -> Optional[dict]:
+        """返回 {"media", "file_id"}，未缓存时返回 None"""
+        if not file_unique_id:
+            return None
+        return self.entries.get(file_unique_id)
+
+    def missing(self, records: List[CachedMessage]) -> List[CachedMessage]:
+        """返回带文件但尚未缓存的记录"""
+        return [record for record in records if record.file_unique_id and record.file_unique_id not in self.entries]
+
+    def remember(self, sent_messages: List) -> int:
+        """记录 Bot 发出的消息中的 file_id，返回新增的数量"""
+        added = 0
+        for message in sent_messages:
+            record = CachedMessage.from_message(message)
+            if not record.file_id or not record.file_unique_id:
+                continue
+            if record.file_unique_id not in self.entries:
+                added += 1
+            self.entries[record.file_unique_id] = {"media": record.media, "file_id": record.file_id}
+            self.entries.move_to_end(record.file_unique_id)
+
+        if added:
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            self.dirty = True
+        return added
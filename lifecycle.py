@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import Callable, Dict, List
+
+from config import PENDING_JOBS_FILE, INSTANCE_LOCK_FILE, HANDOVER_REQUEST_FILE
+
+logger = logging.getLogger(__name__)
+
+# 实例锁心跳间隔（秒），超过 3 个间隔未更新的锁视为失效
+HEARTBEAT_INTERVAL = 2
+
+
+class JobTracker:
+    """跟踪进行中的转发任务，停止时等待其完成并保存未完成的任务
+
+    任务以 {"chat_id", "message_id", "processing_message_id"} 形式保存，
+    下次启动时根据用户的原始消息重新处理。
+    """
+
+    def __init__(self, path: str = PENDING_JOBS_FILE):
+        self.path = path
+        self.active: Dict[int, dict] = {}
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.deferred: List[dict] = []
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.next_id = 0
+
+    def start(self, job: dict, task: asyncio.Task) -> int:
+        """登记一个进行中的任务，返回任务编号"""
+        self.next_id += 1
+        self.active[self.next_id] = job
+        self.tasks[self.next_id] = task
+        self.idle.clear()
+        return self.next_id
+
+    def finish(self, job_id: int):
+        """任务结束（无论成功与否）"""
+        self.active.pop(job_id, None)
+        self.tasks.pop(job_id, None)
+        if not self.active:
+            self.idle.set()
+
+    def defer(self, job: dict):
+        """停止过程中收到的新任务，直接保存留给下一个实例处理"""
+        self.deferred.append(job)
+        self.persist()
+
+    async def drain(self, timeout: float) -> bool:
+        """等待进行中的任务完成，超时返回 False"""
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def cancel_active(self):
+        """取消仍在运行的任务并等待其退出
+
+        被取消的任务先转入 deferred，之后 defer() 重写文件时仍会保存它们
+        """
+        self.deferred.extend(self.active.values())
+        self.active.clear()
+        self.idle.set()
+        tasks = [task for task in self.tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def persist(self) -> int:
+        """保存未完成的任务，返回保存的数量"""
+        jobs = list(self.active.values()) + self.deferred
+        try:
+            if not jobs:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return 0
+
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(jobs, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error("保存未完成任务失败: %s", e)
+        return len(jobs)
+
+    def load_pending(self) -> List[dict]:
+        """读取上一个实例留下的任务并删除文件"""
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                jobs = json.load(f)
+            os.remove(self.path)
+            return jobs
+        except Exception as e:
+            logger.error("读取未完成任务失败: %s", e)
+            return []
+
+
+class InstanceLock:
+    """Bot 实例锁与交接
+
+    持有 Bot Token 的实例定期刷新锁文件。新实例以交接模式启动时先预热客户端，
+    再写入交接请求；旧实例看到请求后优雅停止并删除锁文件，新实例随后接管 Bot。
+    """
+
+    def __init__(self, lock_path: str = INSTANCE_LOCK_FILE, request_path: str = HANDOVER_REQUEST_FILE):
+        self.lock_path = lock_path
+        self.request_path = request_path
+        self.instance_id = uuid.uuid4().hex
+
+    def is_held_by_other(self) -> bool:
+        """其他实例是否持有有效的锁"""
+        try:
+            with open(self.lock_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if data.get("instance_id") == self.instance_id:
+            return False
+        return time.time() - data.get("heartbeat", 0) < HEARTBEAT_INTERVAL * 3
+
+    def refresh(self):
+        """写入或刷新锁文件"""
+        with open(self.lock_path, "w", encoding="utf-8") as f:
+            json.dump({"instance_id": self.instance_id, "pid": os.getpid(), "heartbeat": time.time()}, f)
+
+    def release(self):
+        """删除自己持有的锁"""
+        try:
+            with open(self.lock_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("instance_id") == self.instance_id:
+                os.remove(self.lock_path)
+        except (FileNotFoundError, ValueError):
+            pass
+
+    async def request_handover(self, timeout: float) -> bool:
+        """请求旧实例交出 Bot，等待其释放锁；超时返回 False"""
+        if not self.is_held_by_other():
+            return True
+
+        logger.info("请求旧实例交接")
+        with open(self.request_path, "w", encoding="utf-8") as f:
+            f.write(self.instance_id)
+
+        deadline = time.monotonic() + timeout
+        while self.is_held_by_other():
+            if time.monotonic() > deadline:
+                logger.warning("等待旧实例交接超时，强制接管")
+                return False
+            await asyncio.sleep(HEARTBEAT_INTERVAL / 2)
+        return True
+
+    async def watch(self, on_handover: Callable[[], None]):
+        """定期刷新锁文件，发现交接请求时调用 on_handover
+
+        停止过程中仍需继续刷新，直到调用方释放锁后取消该任务，
+        否则新实例会在旧实例停止完成前就认为锁已失效。
+        """
+        while True:
+            self.refresh()
+            if os.path.exists(self.request_path):
+                try:
+                    with open(self.request_path, "r", encoding="utf-8") as f:
+                        requester = f.read().strip()
+                    os.remove(self.request_path)
+                except FileNotFoundError:
+                    requester = ""
+                if requester and requester != self.instance_id:
+                    logger.info("收到新实例的交接请求，开始优雅停止")
+                    on_handover()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
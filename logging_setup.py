@@ -0,0 +1,112 @@
+"""
+集中式日志配置
+
+日志记录只在调用线程中打上追踪ID并放入队列，格式化和写入由后台监听线程完成，
+事件循环不会因为日志 I/O 阻塞。每个转发任务有独立的追踪ID，INFO 及以下级别的
+日志按任务采样，WARNING 及以上始终输出。
+
+环境变量:
+- LOG_LEVEL: 日志级别（默认 INFO）
+- LOG_FORMAT: text 或 json（默认 text）
+- LOG_FILE: 日志文件路径，留空则只输出到控制台（默认 extractor.log）
+- LOG_SAMPLE_RATE: 任务内 INFO 日志的采样比例 0~1（默认 1，即全部输出）
+"""
+
+import os
+import json
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+from dotenv import load_dotenv
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s'
+
+# 当前任务的追踪ID和是否采样；asyncio 任务创建时会复制上下文，追踪ID随任务传递
+current_trace_id: ContextVar[str] = ContextVar("trace_id", default="-")
+current_trace_sampled: ContextVar[bool] = ContextVar("trace_sampled", default=True)
+
+_sample_rate = 1.0
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def new_trace(prefix: str = "") -> str:
+    """为新任务生成追踪ID，并决定该任务的 INFO 日志是否采样输出"""
+    trace_id = f"{prefix}{uuid.uuid4().hex[:8]}"
+    current_trace_id.set(trace_id)
+    current_trace_sampled.set(random.random() < _sample_rate)
+    return trace_id
+
+
+class TraceFilter(logging.Filter):
+    """在调用线程中写入追踪ID，并丢弃未采样任务的 INFO 及以下日志"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id.get()
+        if record.levelno <= logging.INFO and not current_trace_sampled.get():
+            return False
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """不在调用线程中格式化的 QueueHandler
+
+    标准 QueueHandler.prepare 会在入队前格式化消息，这里直接入队原始记录，
+    由监听线程完成 msg % args 和异常堆栈的格式化。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """每行一个 JSON 对象"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def setup_logging():
+    """配置根日志记录器，重复调用无副作用"""
+    global _sample_rate, _listener
+    if _listener:
+        return
+
+    load_dotenv()
+    level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    log_format = os.getenv('LOG_FORMAT', 'text').lower()
+    log_file = os.getenv('LOG_FILE', 'extractor.log')
+    _sample_rate = float(os.getenv('LOG_SAMPLE_RATE', '1'))
+
+    formatter = JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(TraceFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
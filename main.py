@@ -6,14 +6,15 @@ Telegram 消息转发工具
 
 import asyncio
 import logging
+import signal
 import sys
 import os
 
-# 设置日志格式
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from logging_setup import setup_logging
+from runtime import setup_event_loop, log_backends
+
+# 设置日志（队列异步写入，格式和级别见 logging_setup.py）
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
@@ -27,33 +28,44 @@ async def main():
     try:
         # 导入配置和Bot类（环境变量检查在config.py中自动执行）
         from bot_handler import MessageExtractorBot
+        from config import HANDOVER
         
         # 创建并启动Bot
         bot = MessageExtractorBot()
+        log_backends()
     except ValueError as e:
         # 捕获配置错误
         logger.error("配置错误:")
         print(str(e))
         sys.exit(1)
     except ImportError as e:
-        logger.error(f"导入错误: {e}")
+        logger.error("导入错误: %s", e)
         sys.exit(1)
     
+    # SIGTERM（docker stop / 重新部署）触发优雅停止
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, bot.request_shutdown)
+    except NotImplementedError:
+        # Windows 不支持 add_signal_handler
+        pass
+    
     try:
-        await bot.start()
+        await bot.start(handover=HANDOVER)
     except KeyboardInterrupt:
         logger.info("程序被用户中断")
     except Exception as e:
-        logger.error(f"程序运行出错: {e}", exc_info=True)
+        logger.error("程序运行出错: %s", e, exc_info=True)
     finally:
         logger.info("程序结束")
 
 
 if __name__ == "__main__":
     try:
+        # 加速模式（ACCELERATED，默认开启）下使用 uvloop，需在创建事件循环前设置
+        setup_event_loop()
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("程序被强制中断")
     except Exception as e:
-        logger.error(f"启动失败: {e}", exc_info=True)
+        logger.error("启动失败: %s", e, exc_info=True)
         sys.exit(1)
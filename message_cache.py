@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class MessageCache:
+    """带过期时间的 LRU 缓存，保存已解析的消息
+
+    键由调用方决定，例如 (chat, message_id) 或 (chat, "group", media_group_id)。
+    超过 max_size 时淘汰最久未使用的条目，超过 ttl 秒的条目在读取时丢弃。
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def chat_key(chat_id) -> str:
+        """统一聊天标识：用户名不区分大小写，数字ID转为字符串"""
+        return str(chat_id).lower()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """读取缓存，不存在或已过期时返回 None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """读取未过期的条目，不计入命中统计也不调整淘汰顺序"""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def contains(self, key: Hashable) -> bool:
+        """检查是否有未过期的条目（不计入命中统计）"""
+        entry = self.entries.get(key)
+        return entry is not None and entry[0] >= time.monotonic()
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """写入缓存并淘汰多余的条目，ttl 为空时使用默认过期时间"""
+        self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -1,14 +1,45 @@
 import re
+import uuid
 import asyncio
+import mimetypes
 from pyrogram import Client
+from pyrogram.errors import (
+    ChannelPrivate, ChannelInvalid, ChannelBanned, ChatIdInvalid, PeerIdInvalid, UserBannedInChannel,
+    UsernameNotOccupied, UsernameInvalid, MsgIdInvalid
+)
 from pyrogram.types import Message
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import logging
+from config import (
+    MESSAGE_CACHE_SIZE, MESSAGE_CACHE_TTL, NEGATIVE_CACHE_SIZE, NEGATIVE_TTL_NOT_FOUND, NEGATIVE_TTL_NO_ACCESS,
+    NEGATIVE_TTL_NO_CHAT
+)
+from message_cache import MessageCache
+from cached_message import CachedMessage
+from prefetcher import Prefetcher
+from policy import run_stage
 
-# 设置日志
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 链接失败的原因
+INVALID_LINK = "invalid_link"
+NOT_FOUND = "not_found"
+NO_ACCESS = "no_access"
+NO_CHAT = "no_chat"
+
+# 各原因在负缓存中的保存时间；NO_ACCESS 和 NO_CHAT 针对整个聊天，NOT_FOUND 针对单条消息
+FAILURE_TTLS = {
+    NOT_FOUND: NEGATIVE_TTL_NOT_FOUND,
+    NO_ACCESS: NEGATIVE_TTL_NO_ACCESS,
+    NO_CHAT: NEGATIVE_TTL_NO_CHAT,
+}
+CHAT_FAILURES = (NO_ACCESS, NO_CHAT)
+
+# 获取消息时表示消息不存在、聊天无法访问或不存在的错误
+NOT_FOUND_ERRORS = (MsgIdInvalid,)
+NO_ACCESS_ERRORS = (ChannelPrivate, ChannelInvalid, ChannelBanned, ChatIdInvalid, PeerIdInvalid, UserBannedInChannel)
+NO_CHAT_ERRORS = (UsernameNotOccupied, UsernameInvalid)
+
 
 class MessageExtractor:
     """消息提取器类"""
@@ -18,6 +49,13 @@ class MessageExtractor:
         self.api_hash = api_hash
         self.session_name = session_name
         self.client = None
+        # 已解析消息的缓存，由顺序阅读预取器在后台预热
+        self.cache = MessageCache(MESSAGE_CACHE_SIZE, MESSAGE_CACHE_TTL)
+        # 失败链接的负缓存 {(聊天,) 或 (聊天, 消息ID): 失败原因}，过期时间按原因设置
+        self.negative_cache = MessageCache(NEGATIVE_CACHE_SIZE, NEGATIVE_TTL_NOT_FOUND)
+        self.prefetcher = Prefetcher(self)
+        # 需要在用户客户端上注册的更新处理器（客户端重建时会重新注册）
+        self.update_handlers = []
     
     async def initialize(self):
         """初始化客户端"""
@@ -26,15 +64,60 @@ class MessageExtractor:
             api_id=self.api_id,
             api_hash=self.api_hash
         )
+        for handler in self.update_handlers:
+            self.client.add_handler(handler)
         await self.client.start()
         logger.info("消息提取客户端已启动")
     
     async def close(self):
         """关闭客户端"""
+        # 预取任务使用该客户端，先取消
+        await self.prefetcher.cancel()
         if self.client:
             await self.client.stop()
             logger.info("消息提取客户端已关闭")
     
+    def add_update_handler(self, handler):
+        """注册用户客户端的更新处理器，例如频道新消息监听"""
+        self.update_handlers.append(handler)
+        if self.client:
+            self.client.add_handler(handler)
+    
+    def parse_chat_identifier(self, text: str):
+        """解析频道标识
+        
+        支持的格式:
+        - @channel_username / channel_username
+        - https://t.me/channel_username
+        - https://t.me/c/channel_id
+        - -100123456789
+        """
+        text = text.strip()
+        text = re.sub(r'^(?:https?://)?t\.me/', '', text).strip('/')
+        
+        if text.startswith('c/'):
+            channel_id = text[2:].split('/')[0]
+            return int(f"-100{channel_id}") if channel_id.isdigit() else None
+        
+        text = text.split('/')[0].lstrip('@')
+        if re.fullmatch(r'-?\d+', text):
+            return int(text)
+        if re.fullmatch(r'[a-zA-Z0-9_]+', text):
+            return text
+        return None
+    
+    def cache_messages(self, messages: List[Message]) -> List[CachedMessage]:
+        """把已收到的消息转换为精简记录并写入缓存"""
+        records = []
+        for msg in messages:
+            record = CachedMessage.from_message(msg)
+            records.append(record)
+            # 用户可能用频道用户名或数字ID的链接请求，两种键都写入
+            for chat in (msg.chat.id, msg.chat.username):
+                if chat:
+                    self.cache.put((MessageCache.chat_key(chat), record.message_id), record)
+        return records
+    
     def parse_message_link(self, link: str) -> Optional[Dict[str, Any]]:
         """解析消息链接
         
@@ -80,69 +163,171 @@ class MessageExtractor:
         
         return None
     
-    async def get_media_group_messages(self, link: str):
-        """获取媒体组中的所有消息"""
+    def failure_keys(self, parsed: Dict[str, Any]) -> tuple:
+        """负缓存中链接对应的键：整个聊天、单条消息"""
+        chat_key = MessageCache.chat_key(parsed['chat_id'])
+        return (chat_key,), (chat_key, parsed['message_id'])
+    
+    def cached_failure(self, parsed: Dict[str, Any]) -> Optional[str]:
+        """请求前检查负缓存，返回失败原因"""
+        chat_failure_key, message_failure_key = self.failure_keys(parsed)
+        return self.negative_cache.get(chat_failure_key) or self.negative_cache.get(message_failure_key)
+    
+    def remember_failure(self, parsed: Dict[str, Any], reason: str):
+        """把失败原因写入负缓存"""
+        chat_failure_key, message_failure_key = self.failure_keys(parsed)
+        key = chat_failure_key if reason in CHAT_FAILURES else message_failure_key
+        self.negative_cache.put(key, reason, ttl=FAILURE_TTLS[reason])
+    
+    def failure_reason(self, link: str) -> Optional[str]:
+        """get_media_group_messages 返回 None 后，查询该链接的失败原因；临时错误返回 None"""
+        parsed = self.parse_message_link(link)
+        if not parsed:
+            return INVALID_LINK
+        chat_failure_key, message_failure_key = self.failure_keys(parsed)
+        return self.negative_cache.peek(chat_failure_key) or self.negative_cache.peek(message_failure_key)
+    
+    def uncached_ids(self, chat_id, message_ids: List[int]) -> List[int]:
+        """返回不在缓存中的消息ID"""
+        chat_key = MessageCache.chat_key(chat_id)
+        return [mid for mid in message_ids if not self.cache.contains((chat_key, mid))]
+    
+    async def fetch_messages(self, chat_id, message_ids: List[int]) -> Dict[int, CachedMessage]:
+        """批量获取消息，优先读取缓存，缺失的部分用一次 get_messages 获取
+        
+        返回 {message_id: CachedMessage}，不存在的消息不会出现在结果中。
+        预取和媒体组扫描都经过这里，查缓存时不计入命中统计
+        """
+        chat_key = MessageCache.chat_key(chat_id)
+        found = {}
+        missing = []
+        for mid in message_ids:
+            cached = self.cache.peek((chat_key, mid))
+            if cached is not None:
+                found[mid] = cached
+            else:
+                missing.append(mid)
+        
+        if missing:
+            messages = await run_stage("resolve", self.client.get_messages, chat_id=chat_id, message_ids=missing)
+            for msg in messages:
+                # 不存在的消息以 empty 形式返回，不缓存（之后可能会发布）
+                if msg and not msg.empty:
+                    record = CachedMessage.from_message(msg)
+                    self.cache.put((chat_key, record.message_id), record)
+                    found[record.message_id] = record
+        
+        return found
+    
+    async def get_media_group_messages(self, link: str, user_id: Optional[int] = None):
+        """获取媒体组中的所有消息
+        
+        传入 user_id 时会记录该用户的阅读位置，用于顺序阅读预取
+        """
         if not self.client:
             raise RuntimeError("客户端未初始化，请先调用 initialize()")
         
         # 解析链接
         parsed = self.parse_message_link(link)
         if not parsed:
-            logger.error(f"无法解析消息链接: {link}")
+            logger.error("无法解析消息链接: %s", link)
+            return None
+        
+        # 最近失败过的链接不再请求 API
+        failure = self.cached_failure(parsed)
+        if failure:
+            logger.info("链接命中负缓存（%s）: %s", failure, link)
             return None
         
         try:
-            logger.info(f"尝试获取消息: chat_id={parsed['chat_id']}, message_id={parsed['message_id']}, type={parsed['type']}")
-            
-            # 获取原始消息
-            original_message = await self.client.get_messages(
-                chat_id=parsed['chat_id'],
-                message_ids=parsed['message_id']
-            )
+            logger.info("尝试获取消息: chat_id=%s, message_id=%s, type=%s", parsed['chat_id'], parsed['message_id'], parsed['type'])
             
-            logger.info(f"get_messages 返回结果类型: {type(original_message)}")
+            # 获取原始消息（优先使用缓存），命中率只统计用户请求的这条消息
+            original_message = self.cache.get((MessageCache.chat_key(parsed['chat_id']), parsed['message_id']))
+            if original_message is None:
+                fetched = await self.fetch_messages(parsed['chat_id'], [parsed['message_id']])
+                original_message = fetched.get(parsed['message_id'])
             
             if not original_message:
-                logger.error(f"未找到消息: chat_id={parsed['chat_id']}, message_id={parsed['message_id']}")
+                logger.error("未找到消息: chat_id=%s, message_id=%s", parsed['chat_id'], parsed['message_id'])
+                self.remember_failure(parsed, NOT_FOUND)
                 return None
             
-            logger.info(f"成功获取消息: {original_message.id} from {original_message.chat.title or original_message.chat.id}")
+            logger.info("成功获取消息: %s from %s", original_message.message_id, original_message.chat_id)
             
             # 检查是否是媒体组消息
-            if hasattr(original_message, 'media_group_id') and original_message.media_group_id:
-                logger.info(f"检测到媒体组: {original_message.media_group_id}")
-                
-                # 获取媒体组中的所有消息
-                # 尝试获取前后几条消息来找到完整的媒体组
-                media_group_messages = []
-                
-                # 获取一个范围的消息ID来寻找媒体组
-                start_id = max(1, parsed['message_id'] - 10)
-                end_id = parsed['message_id'] + 10
-                
-                messages = await self.client.get_messages(
-                    chat_id=parsed['chat_id'],
-                    message_ids=list(range(start_id, end_id + 1))
-                )
-                
-                # 筛选出属于同一媒体组的消息
-                target_group_id = original_message.media_group_id
-                for msg in messages:
-                    if (msg and hasattr(msg, 'media_group_id') and 
-                        msg.media_group_id == target_group_id):
-                        media_group_messages.append(msg)
-                
-                # 按消息ID排序
-                media_group_messages.sort(key=lambda x: x.id)
-                logger.info(f"找到媒体组消息数量: {len(media_group_messages)}")
-                
-                # 过滤掉None消息
-                valid_messages = [msg for msg in media_group_messages if msg is not None]
-                return valid_messages if valid_messages else [original_message]
+            if original_message.media_group_id:
+                logger.info("检测到媒体组: %s", original_message.media_group_id)
+                result = await self.collect_media_group(parsed['chat_id'], original_message)
             else:
                 # 不是媒体组，返回单个消息
-                return [original_message]
+                result = [original_message]
+            
+            self.prefetcher.observe(user_id, parsed['chat_id'], parsed['message_id'], result[-1].message_id)
+            return result
             
         except Exception as e:
-            logger.error(f"获取媒体组消息时出错: {e}")
+            logger.error("获取媒体组消息时出错: %s", e)
+            if isinstance(e, NOT_FOUND_ERRORS):
+                self.remember_failure(parsed, NOT_FOUND)
+            elif isinstance(e, NO_ACCESS_ERRORS):
+                self.remember_failure(parsed, NO_ACCESS)
+            elif isinstance(e, NO_CHAT_ERRORS):
+                self.remember_failure(parsed, NO_CHAT)
+            return None
+    
+    async def collect_media_group(self, chat_id, original_message: CachedMessage) -> List[CachedMessage]:
+        """获取与 original_message 同属一个媒体组的全部消息"""
+        target_group_id = original_message.media_group_id
+        group_key = (MessageCache.chat_key(chat_id), "group", target_group_id)
+        cached_group = self.cache.peek(group_key)
+        if cached_group is not None:
+            return cached_group
+        
+        # 获取媒体组中的所有消息
+        # 尝试获取前后几条消息来找到完整的媒体组
+        start_id = max(1, original_message.message_id - 10)
+        end_id = original_message.message_id + 10
+        messages = await self.fetch_messages(chat_id, list(range(start_id, end_id + 1)))
+        
+        # 筛选出属于同一媒体组的消息，并按消息ID排序
+        media_group_messages = sorted(
+            (msg for msg in messages.values() if msg.media_group_id == target_group_id),
+            key=lambda x: x.message_id
+        )
+        logger.info("找到媒体组消息数量: %s", len(media_group_messages))
+        
+        if not media_group_messages:
+            return [original_message]
+        
+        self.cache.put(group_key, media_group_messages)
+        return media_group_messages
+    
+    @staticmethod
+    def download_file_name(record: CachedMessage) -> Optional[str]:
+        """下载时使用的文件名
+        
+        通过 file_id 下载时 Pyrogram 既不知道原文件名也不知道 mime_type，
+        没有文件名的文档会丢失扩展名，这里按记录的 mime_type 补上。
+        无法推断扩展名时返回 None，交给 Pyrogram 按媒体类型命名
+        """
+        if record.file_name:
+            return record.file_name
+        extension = mimetypes.guess_extension(record.mime_type) if record.mime_type else None
+        if not extension:
             return None
+        return f"{record.media}_{record.message_id}_{uuid.uuid4().hex[:8]}{extension}"
+    
+    async def download(self, record: CachedMessage, progress=None) -> Optional[str]:
+        """用用户客户端下载记录中的媒体文件，返回本地路径"""
+        kwargs = {}
+        if progress:
+            # 按 file_id 下载时 Pyrogram 回调的总大小为 0，用记录中的文件大小代替，
+            # 否则进度消息无法显示百分比和剩余时间
+            async def report(current: int, total: int):
+                await progress(current, total or record.file_size or 0)
+            kwargs["progress"] = report
+        file_name = self.download_file_name(record)
+        if file_name:
+            kwargs["file_name"] = file_name
+        return await run_stage("download", self.client.download_media, record.file_id, size=record.file_size, **kwargs)
@@ -0,0 +1,186 @@
+"""
+分阶段超时、重试预算与错误分类
+
+每个 API 调用按阶段（resolve/copy/send/download/upload）执行：
+- 超时根据该阶段观测到的延迟（EWMA）自适应，下载/上传还会按媒体大小和观测速率放宽
+- 错误分为可重试（网络、超时、服务端错误）、限流（FloodWait）和永久错误
+- 可重试和限流错误在任务级重试预算内按带抖动的指数退避重试；
+  向目标聊天发送的阶段超时时不重试，因为请求可能已被 Telegram 接受，只是响应迟到
+- 目标聊天不可达（用户屏蔽 Bot 等）、发送被长时间限流或发送超时时整个任务中止，
+  后续回退方案直接跳过，不再发起调用
+"""
+
+import time
+import random
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from pyrogram.errors import (
+    Flood, FloodWait, InternalServerError, ServiceUnavailable,
+    UserIsBlocked, InputUserDeactivated, ChatWriteForbidden
+)
+
+from config import JOB_RETRY_BUDGET, JOB_RETRY_WAIT
+from traffic import note_stage
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE = "retryable"
+THROTTLED = "throttled"
+PERMANENT = "permanent"
+
+# 各阶段的基础超时（秒）
+BASE_TIMEOUTS = {
+    "resolve": 20,
+    "copy": 20,
+    "send": 30,
+    "download": 60,
+    "upload": 60,
+}
+# 自适应超时为观测延迟的倍数
+LATENCY_MULTIPLIER = 4
+# 下载/上传按大小放宽超时时使用的最低速率（字节/秒）
+MIN_TRANSFER_RATE = 256 * 1024
+# EWMA 平滑系数
+EWMA_ALPHA = 0.2
+# 退避的基础间隔和上限（秒）
+BACKOFF_BASE = 1
+BACKOFF_CAP = 20
+
+# 向目标聊天发送的阶段
+DESTINATION_STAGES = ("copy", "send", "upload")
+# 发送阶段出现这些错误说明目标聊天不可达，同一任务的其他回退方案也必然失败
+DESTINATION_ERRORS = (UserIsBlocked, InputUserDeactivated, ChatWriteForbidden)
+
+
+class JobAborted(BaseException):
+    """目标聊天不可达，任务中止
+
+    与 asyncio.CancelledError 一样继承 BaseException，使其穿过各回退方案的
+    except Exception 直接到达任务入口，途中的 finally（释放预留、清理文件）照常执行。
+    """
+
+
+class StageStats:
+    """单个阶段的观测延迟与传输速率"""
+
+    def __init__(self, base_timeout: float):
+        self.base_timeout = base_timeout
+        self.latency: Optional[float] = None
+        self.rate: Optional[float] = None
+
+    def observe(self, elapsed: float, size: Optional[int] = None):
+        """记录一次调用的耗时"""
+        if size:
+            rate = size / max(elapsed, 1e-3)
+            self.rate = rate if self.rate is None else (1 - EWMA_ALPHA) * self.rate + EWMA_ALPHA * rate
+        else:
+            self.latency = elapsed if self.latency is None else (1 - EWMA_ALPHA) * self.latency + EWMA_ALPHA * elapsed
+
+    def timeout(self, size: Optional[int] = None) -> float:
+        """当前的超时时间：基础值与观测延迟倍数取大，再加上按大小估算的传输时间"""
+        timeout = self.base_timeout
+        if self.latency is not None:
+            timeout = max(timeout, self.latency * LATENCY_MULTIPLIER)
+        if size:
+            # 按观测速率的 1/4 估算，避免慢速文件被误判超时
+            rate = max(self.rate / 4, MIN_TRANSFER_RATE) if self.rate else MIN_TRANSFER_RATE
+            timeout += size / rate
+        return timeout
+
+
+stage_stats: Dict[str, StageStats] = {stage: StageStats(timeout) for stage, timeout in BASE_TIMEOUTS.items()}
+
+
+class RetryBudget:
+    """单个任务的重试预算：最多重试次数和累计等待时间"""
+
+    def __init__(self, max_retries: int = JOB_RETRY_BUDGET, max_wait: float = JOB_RETRY_WAIT):
+        self.retries_left = max_retries
+        self.wait_left = max_wait
+        self.aborted: Optional[JobAborted] = None
+
+    def consume(self, delay: float) -> bool:
+        """占用一次重试和 delay 秒等待，预算不足时返回 False"""
+        if self.retries_left <= 0 or delay > self.wait_left:
+            return False
+        self.retries_left -= 1
+        self.wait_left -= delay
+        return True
+
+
+current_budget: ContextVar[Optional[RetryBudget]] = ContextVar("retry_budget", default=None)
+
+
+def new_job_budget(**kwargs) -> RetryBudget:
+    """为当前任务（及其创建的子任务）设置新的重试预算"""
+    budget = RetryBudget(**kwargs)
+    current_budget.set(budget)
+    return budget
+
+
+def classify(error: BaseException) -> str:
+    """把异常分为可重试、限流或永久错误"""
+    if isinstance(error, Flood):
+        return THROTTLED
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError, OSError, InternalServerError, ServiceUnavailable)):
+        return RETRYABLE
+    return PERMANENT
+
+
+def backoff_delay(attempt: int) -> float:
+    """带完全抖动的指数退避"""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+async def run_stage(stage: str, func, *args, size: Optional[int] = None, **kwargs):
+    """按阶段策略执行 func(*args, **kwargs)
+
+    size 为本次传输的字节数（下载/上传阶段用于放宽超时）
+    """
+    budget = current_budget.get() or RetryBudget()
+    if budget.aborted:
+        raise budget.aborted
+
+    stats = stage_stats[stage]
+    attempt = 0
+    while True:
+        timeout = stats.timeout(size)
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), timeout=timeout)
+            elapsed = time.monotonic() - started
+            stats.observe(elapsed, size)
+            note_stage(stage, elapsed, ok=True)
+            return result
+        except Exception as e:
+            note_stage(stage, time.monotonic() - started, ok=False)
+            kind = classify(e)
+            if isinstance(e, asyncio.TimeoutError):
+                # 超时也计入观测，使后续超时逐步放宽
+                stats.observe(time.monotonic() - started, size)
+                logger.warning("%s 阶段超时（%.0f 秒）", stage, timeout)
+                if stage in DESTINATION_STAGES:
+                    # 发送不是幂等的：重试或改用其他方式发送都可能让用户收到重复消息
+                    budget.aborted = JobAborted("发送超时，消息可能已经送达，为避免重复发送不再重试")
+                    raise budget.aborted from e
+
+            if kind == PERMANENT:
+                if stage in DESTINATION_STAGES and isinstance(e, DESTINATION_ERRORS):
+                    budget.aborted = JobAborted(f"目标聊天不可达: {e}")
+                    raise budget.aborted from e
+                raise
+
+            delay = e.value if isinstance(e, FloodWait) else backoff_delay(attempt)
+            if not budget.consume(delay):
+                logger.warning("%s 阶段重试预算已用尽（%s）: %s", stage, kind, e)
+                if kind == THROTTLED and stage in DESTINATION_STAGES:
+                    # Bot 被限流时其他回退方案同样会被限流，继续尝试只会延长等待
+                    budget.aborted = JobAborted(f"Telegram 限流，需要等待 {delay} 秒")
+                    raise budget.aborted from e
+                raise
+            logger.warning("%s 阶段出错（%s），%.1f 秒后重试: %s", stage, kind, delay, e)
+            await asyncio.sleep(delay)
+            attempt += 1
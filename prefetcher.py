@@ -0,0 +1,104 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from config import PREFETCH_COUNT, PREFETCH_DELAY, PREFETCH_BUDGET
+from message_cache import MessageCache
+from policy import new_job_budget
+from traffic import current_record
+
+logger = logging.getLogger(__name__)
+
+# 两次请求的消息ID相差不超过该值时视为顺序阅读
+SEQUENTIAL_GAP = 2
+# 最多跟踪的 (用户, 聊天) 阅读位置数量
+MAX_TRACKED_READERS = 1000
+# 预取调用预算的统计窗口（秒）
+BUDGET_WINDOW = 60
+
+
+class Prefetcher:
+    """顺序阅读预取器
+
+    记录每个 (用户, 聊天) 最近读取的位置。检测到顺序阅读后，在后台用一次
+    get_messages 批量获取后续几条消息写入提取器的缓存，之后的请求直接命中内存。
+    预取任务延迟执行、同一时间只运行一个，并受每分钟调用预算限制。
+    """
+
+    def __init__(self, extractor, count: int = PREFETCH_COUNT, delay: float = PREFETCH_DELAY,
+                 budget: int = PREFETCH_BUDGET):
+        self.extractor = extractor
+        self.count = count
+        self.delay = delay
+        self.budget = budget
+        self.positions: "OrderedDict[tuple, int]" = OrderedDict()
+        self.recent_calls: deque = deque()
+        self.semaphore = asyncio.Semaphore(1)
+        self.tasks = set()
+
+    def observe(self, user_id, chat_id, requested_id: int, last_id: int):
+        """记录一次读取，顺序阅读时安排后台预取
+
+        requested_id 是用户请求的消息ID，last_id 是本次解析到的最大消息ID（媒体组的最后一条）
+        """
+        if user_id is None or self.count <= 0:
+            return
+
+        key = (user_id, MessageCache.chat_key(chat_id))
+        previous = self.positions.pop(key, None)
+        self.positions[key] = last_id
+        while len(self.positions) > MAX_TRACKED_READERS:
+            self.positions.popitem(last=False)
+
+        if previous is None or not 0 < requested_id - previous <= SEQUENTIAL_GAP:
+            return
+
+        message_ids = list(range(last_id + 1, last_id + 1 + self.count))
+        task = asyncio.create_task(self.prefetch(chat_id, message_ids))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def within_budget(self) -> bool:
+        """检查并占用一次预取调用预算"""
+        now = time.monotonic()
+        while self.recent_calls and now - self.recent_calls[0] > BUDGET_WINDOW:
+            self.recent_calls.popleft()
+        if len(self.recent_calls) >= self.budget:
+            return False
+        self.recent_calls.append(now)
+        return True
+
+    async def prefetch(self, chat_id, message_ids: list):
+        """后台批量获取消息并写入缓存"""
+        # 低优先级：先让出时间给前台请求，且同时只运行一个预取任务
+        await asyncio.sleep(self.delay)
+        if self.semaphore.locked():
+            logger.debug("已有预取任务在运行，跳过: %s %s", chat_id, message_ids)
+            return
+
+        # 预取任务继承了前台任务的上下文：换成不重试的独立预算，避免占用前台任务的重试次数，
+        # 也不计入前台请求的流量记录
+        new_job_budget(max_retries=0)
+        current_record.set(None)
+
+        async with self.semaphore:
+            missing = self.extractor.uncached_ids(chat_id, message_ids)
+            if not missing:
+                return
+            if not self.within_budget():
+                logger.debug("预取调用超出预算，跳过: %s %s", chat_id, missing)
+                return
+
+            try:
+                fetched = await self.extractor.fetch_messages(chat_id, missing)
+                logger.debug("预取完成: chat_id=%s, 请求 %s 条, 缓存 %s 条", chat_id, len(missing), len(fetched))
+            except Exception as e:
+                logger.debug("预取消息失败: %s", e)
+
+    async def cancel(self):
+        """取消尚未完成的预取任务并等待其退出，需在关闭客户端之前调用"""
+        tasks = [task for task in self.tasks if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,116 @@
+import io
+import os
+import time
+import pstats
+import asyncio
+import cProfile
+import logging
+import tempfile
+import statistics
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 事件循环延迟的采样间隔（秒）
+LAG_SAMPLE_INTERVAL = 0.1
+
+# 同一时间只允许一个分析会话（cProfile 不能嵌套启用）
+_profile_lock = asyncio.Lock()
+
+
+class ProfileBusyError(RuntimeError):
+    """已有分析会话在运行"""
+
+
+async def measure_loop_lag(stop: asyncio.Event) -> List[float]:
+    """反复短暂休眠，记录实际唤醒时间比预期晚了多少（毫秒）"""
+    samples = []
+    while not stop.is_set():
+        expected = time.perf_counter() + LAG_SAMPLE_INTERVAL
+        await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+        samples.append(max(time.perf_counter() - expected, 0) * 1000)
+    return samples
+
+
+def format_lag(samples: List[float]) -> str:
+    """汇总事件循环延迟"""
+    if not samples:
+        return "无采样"
+    ordered = sorted(samples)
+    p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+    return (
+        f"平均 {statistics.mean(samples):.1f}ms，p95 {p95:.1f}ms，"
+        f"最大 {ordered[-1]:.1f}ms（{len(samples)} 次采样）"
+    )
+
+
+def dump_tasks() -> Tuple[int, str]:
+    """返回当前 asyncio 任务数量和每个任务的调用栈"""
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    output = io.StringIO()
+    for task in tasks:
+        output.write(f"--- {task.get_name()} {task.get_coro()!r}\n")
+        task.print_stack(file=output)
+        output.write("\n")
+    return len(tasks), output.getvalue()
+
+
+def top_functions(stats: pstats.Stats, top_n: int) -> str:
+    """按累计耗时列出前 top_n 个函数（需先调用 sort_stats）"""
+    lines = []
+    for func in stats.fcn_list[:top_n]:
+        _, ncalls, _, cumtime, _ = stats.stats[func]
+        filename, line, name = func
+        lines.append(f"{cumtime:8.3f}s {ncalls:>7} {os.path.basename(filename)}:{line}({name})")
+    return "\n".join(lines)
+
+
+async def run_profile(seconds: float, top_n: int = 20) -> Tuple[str, str, str]:
+    """在运行中的事件循环上进行一次 cProfile 分析
+
+    返回 (摘要文本, 完整报告文件路径, 原始 pstats 文件路径)，文件由调用方负责删除
+    """
+    if _profile_lock.locked():
+        raise ProfileBusyError("已有分析会话在运行")
+
+    async with _profile_lock:
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(measure_loop_lag(stop))
+        profiler = cProfile.Profile()
+
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+            stop.set()
+        elapsed = time.perf_counter() - started
+        lag_samples = await lag_task
+        task_count, task_stacks = dump_tasks()
+
+    stats_stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stats_stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top_n)
+
+    summary = (
+        f"⏱ 分析时长: {elapsed:.1f}s\n"
+        f"🔁 事件循环延迟: {format_lag(lag_samples)}\n"
+        f"🧵 asyncio 任务数: {task_count}\n\n"
+        f"累计耗时 / 调用次数 / 函数:\n{top_functions(stats, min(top_n, 10))}"
+    )
+
+    fd, stats_path = tempfile.mkstemp(prefix="profile_", suffix=".prof")
+    os.close(fd)
+    profiler.dump_stats(stats_path)
+
+    fd, report_path = tempfile.mkstemp(prefix="profile_", suffix=".txt")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(summary + "\n\n")
+        f.write(f"===== 累计耗时前 {top_n} 的函数 =====\n")
+        f.write(stats_stream.getvalue())
+        f.write("\n===== asyncio 任务调用栈 =====\n")
+        f.write(task_stacks)
+
+    logger.info("性能分析完成: %.1fs, %s 个任务", elapsed, task_count)
+    return summary, report_path, stats_path
@@ -0,0 +1,127 @@
+import time
+import logging
+from typing import Optional
+
+from config import PROGRESS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+def format_size(num_bytes: float) -> str:
+    """把字节数格式化为易读的大小"""
+    if num_bytes < 1024:
+        return f"{int(num_bytes)} B"
+    for unit in ("KB", "MB"):
+        num_bytes /= 1024
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+    return f"{num_bytes / 1024:.1f} GB"
+
+
+def format_duration(seconds: float) -> str:
+    """把秒数格式化为 1h02m03s 形式"""
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m{secs:02d}s"
+    if minutes:
+        return f"{minutes}m{secs:02d}s"
+    return f"{secs}s"
+
+
+class TransferProgress:
+    """单次下载/上传的进度，作为 Pyrogram 的 progress 回调使用"""
+
+    def __init__(self, reporter: "ProgressReporter", label: str):
+        self.reporter = reporter
+        self.label = label
+        self.started = time.monotonic()
+        self.current = 0
+        self.total = 0
+
+    async def update(self, current: int, total: int):
+        """Pyrogram progress 回调（必须是协程函数才会在事件循环中执行）"""
+        self.current = current
+        self.total = total
+        await self.reporter.refresh(self)
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.monotonic() - self.started, 1e-6)
+
+    @property
+    def rate(self) -> float:
+        """平均速度（字节/秒）"""
+        return self.current / self.elapsed
+
+    def render(self) -> str:
+        """生成进度文本：已传输/总大小、速度和剩余时间"""
+        rate = self.rate
+        lines = [f"🔄 {self.label}"]
+        if self.total:
+            percent = self.current * 100 / self.total
+            lines.append(f"{format_size(self.current)} / {format_size(self.total)} ({percent:.0f}%)")
+        else:
+            lines.append(format_size(self.current))
+        eta = format_duration((self.total - self.current) / rate) if self.total and rate > 0 else "未知"
+        lines.append(f"速度 {format_size(rate)}/s · 剩余 {eta}")
+        return "\n".join(lines)
+
+    def finish(self):
+        """记录本次传输的吞吐量"""
+        logger.info(
+            "%s 完成: %s，用时 %.1fs，平均 %s/s",
+            self.label, format_size(self.current), self.elapsed, format_size(self.rate)
+        )
+
+
+class ProgressReporter:
+    """处理中消息的进度汇报器
+
+    同一条处理中消息上的所有传输共用一个节流窗口：最多每 interval 秒编辑一次，
+    文本未变化时不编辑。status_msg 为空时只统计吞吐量，不编辑消息。
+    """
+
+    def __init__(self, status_msg=None, interval: float = PROGRESS_INTERVAL):
+        self.status_msg = status_msg
+        self.interval = interval
+        # 从创建时开始计时，短任务不会产生额外的编辑
+        self.last_edit = time.monotonic()
+        self.last_text: Optional[str] = None
+
+    def transfer(self, label: str) -> TransferProgress:
+        """开始一次新的传输"""
+        return TransferProgress(self, label)
+
+    async def notify(self, text: str):
+        """立即显示一条状态文本（用于排队等一次性提示）"""
+        if not self.status_msg or text == self.last_text:
+            return
+
+        self.last_edit = time.monotonic()
+        self.last_text = text
+        try:
+            await self.status_msg.edit(text)
+        except Exception as e:
+            logger.debug("更新进度消息失败: %s", e)
+
+    async def refresh(self, transfer: TransferProgress):
+        """按节流规则把传输进度写入处理中消息"""
+        if not self.status_msg:
+            return
+
+        now = time.monotonic()
+        if now - self.last_edit < self.interval:
+            return
+
+        text = transfer.render()
+        if text == self.last_text:
+            return
+
+        self.last_edit = now
+        self.last_text = text
+        try:
+            await self.status_msg.edit(text)
+        except Exception as e:
+            logger.debug("更新进度消息失败: %s", e)
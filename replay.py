@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+流量回放工具
+
+读取 TRAFFIC_RECORD_FILE 录制的 JSONL 记录，按原始到达间隔（除以 --speed）向
+MessageExtractorBot 注入请求，Telegram 由本地模拟客户端代替:
+- 每条记录对应虚拟频道中的一条消息（或相册），媒体类型、数量和大小与录制时一致
+- 模拟 API 调用的耗时取自该记录各阶段的平均耗时，记录中没有的阶段取全部记录的平均值
+- 录制时最终成功的转发方式决定模拟环境允许哪些操作：例如录制为 download 的消息，
+  Bot 复制和按 file_id 发送都会失败，回放时同样需要走下载路径
+- 录制为 not_found 的消息在模拟环境中也不存在
+
+--speed 只压缩请求的到达间隔，API 调用耗时保持不变，用于模拟 N 倍负载，
+据此评估并发任务数、下载预算、缓存大小和限流设置。
+
+用法:
+    python replay.py traffic.jsonl [--speed 4] [--limit 1000] [--bot-rate 30] [--output replayed.jsonl]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from collections import Counter, deque
+from types import SimpleNamespace
+from typing import List, Optional
+
+# 回放不连接 Telegram，也不应写入正式日志；这些变量必须在导入 config 之前设置
+os.environ.setdefault("API_ID", "0")
+os.environ.setdefault("API_HASH", "replay")
+os.environ.setdefault("BOT_TOKEN", "0:replay")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("LOG_FILE", "")
+
+from logging_setup import setup_logging
+from runtime import setup_event_loop
+
+# 模拟调用在记录和全局平均值中都找不到耗时时使用的默认值（秒）
+DEFAULT_LATENCY = 0.05
+# 虚拟频道中相邻两条记录的消息ID间隔，需大于媒体组收集范围（前后各 10 条）
+POST_SPACING = 25
+# Telegram 单个相册最多 10 项
+MEDIA_GROUP_LIMIT = 10
+# 录制为这些转发方式时，模拟环境允许 Bot 复制消息
+COPYABLE_METHODS = ("lean", "copy", "album_copy")
+# 录制为这些转发方式时，模拟环境允许按 file_id 发送
+FILE_ID_METHODS = COPYABLE_METHODS + ("file_id", "album_file_id")
+
+
+class SimulatedRejection(Exception):
+    """模拟 Telegram 拒绝请求（禁止复制、file_id 不可用、相册过大等）"""
+
+
+class SimulatedWorld:
+    """根据录制记录构造的虚拟频道和消息，并统计模拟 API 调用"""
+
+    def __init__(self, entries: List[dict]):
+        self.usernames = {}   # 录制的聊天摘要 -> 虚拟频道用户名
+        self.chat_ids = {}    # 虚拟频道用户名 -> 虚拟聊天ID
+        self.posts = {}       # 录制的消息摘要 -> 链接
+        self.last_id = {}     # 虚拟频道用户名 -> 已分配的最大消息ID
+        self.messages = {}    # (聊天ID, 消息ID) -> (记录, 在相册中的序号)
+        self.files = {}       # 模拟下载的本地文件 -> 记录
+        self.calls = Counter()
+        self.stage_means = self.average_latencies(entries)
+        self.links = [self.add(entry) for entry in entries]
+
+    @staticmethod
+    def average_latencies(entries: List[dict]) -> dict:
+        totals = {}
+        for entry in entries:
+            for stage, stats in entry.get("stages", {}).items():
+                calls, seconds = totals.get(stage, (0, 0.0))
+                totals[stage] = (calls + stats["calls"], seconds + stats["seconds"])
+        return {stage: seconds / calls for stage, (calls, seconds) in totals.items() if calls}
+
+    def latency(self, entry: Optional[dict], stage: str) -> float:
+        """一次模拟调用的耗时"""
+        stats = entry.get("stages", {}).get(stage) if entry else None
+        if stats and stats["calls"]:
+            return stats["seconds"] / stats["calls"]
+        return self.stage_means.get(stage, DEFAULT_LATENCY)
+
+    def add(self, entry: dict) -> str:
+        """为一条记录分配虚拟消息，返回回放时发送的链接"""
+        if entry.get("chat") is None:
+            # 录制时链接就无法解析
+            return "https://t.me/"
+
+        link = self.posts.get(entry["message"])
+        if link is not None:
+            return link
+
+        username = self.usernames.get(entry["chat"])
+        if username is None:
+            username = f"sim_{len(self.usernames) + 1}"
+            self.usernames[entry["chat"]] = username
+            self.chat_ids[username] = -1000000000000 - len(self.usernames)
+            self.last_id[username] = 0
+
+        first_id = self.last_id[username] + POST_SPACING
+        self.last_id[username] = first_id
+        if entry["outcome"] != "not_found":
+            chat_id = self.chat_ids[username]
+            for index in range(max(entry["count"], 1)):
+                self.messages[(chat_id, first_id + index)] = (entry, index)
+
+        link = f"https://t.me/{username}/{first_id}"
+        self.posts[entry["message"]] = link
+        return link
+
+    def lookup(self, file_id: str) -> Optional[dict]:
+        """根据模拟 file_id 找到对应的记录"""
+        _, chat_id, message_id = file_id.split(":")
+        item = self.messages.get((int(chat_id), int(message_id)))
+        return item[0] if item else None
+
+    def build_message(self, chat_id: int, message_id: int):
+        """构造 CachedMessage.from_message 可以读取的模拟消息"""
+        item = self.messages.get((chat_id, message_id))
+        if item is None:
+            return SimpleNamespace(empty=True)
+
+        entry, index = item
+        media = entry["media"]
+        count = max(entry["count"], 1)
+        message = SimpleNamespace(
+            empty=False,
+            chat=SimpleNamespace(id=chat_id),
+            id=message_id,
+            media=None,
+            media_group_id=f"{chat_id}:{message_id - index}" if count > 1 else None,
+            text=SimpleNamespace(markdown="replay") if media == "text" else None,
+            caption=None,
+        )
+        if media and media != "text":
+            message.media = SimpleNamespace(value=media)
+            setattr(message, media, SimpleNamespace(
+                file_id=f"sim:{chat_id}:{message_id}",
+                file_unique_id=f"{chat_id}:{message_id}",
+                file_size=entry["size"] // count or None,
+                mime_type=None,
+                file_name=None,
+            ))
+        return message
+
+    async def call(self, name: str, latency: float):
+        """记录一次模拟调用并等待其耗时"""
+        self.calls[name] += 1
+        await asyncio.sleep(latency)
+
+
+class SimulatedMessage:
+    """模拟的聊天消息（用户发来的链接和 Bot 发出的消息）"""
+
+    def __init__(self, bot: "SimulatedBot", chat_id: int, message_id: int, text: str = None, user_id: int = None):
+        self.bot = bot
+        self.chat = SimpleNamespace(id=chat_id)
+        self.id = message_id
+        self.text = text
+        self.from_user = SimpleNamespace(id=user_id) if user_id is not None else None
+        # 模拟消息不携带媒体；Bot 记录发出消息的 file_id 时按无媒体处理
+        self.media = None
+        self.media_group_id = None
+        self.caption = None
+
+    async def reply(self, text: str, **kwargs):
+        return await self.bot.send_message(self.chat.id, text)
+
+    async def edit(self, text: str, **kwargs):
+        await self.bot.api("edit_message_text", self.bot.world.latency(None, "send"))
+        return self
+
+
+class SimulatedUserClient:
+    """代替 MessageExtractor 中的用户客户端"""
+
+    is_connected = True
+
+    def __init__(self, world: SimulatedWorld):
+        self.world = world
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def add_handler(self, handler):
+        pass
+
+    async def get_messages(self, chat_id, message_ids):
+        chat_id = self.world.chat_ids.get(chat_id, chat_id)
+        items = [self.world.messages.get((chat_id, mid)) for mid in message_ids]
+        entry = next((item[0] for item in items if item), None)
+        await self.world.call("get_messages", self.world.latency(entry, "resolve"))
+        return [self.world.build_message(chat_id, mid) for mid in message_ids]
+
+    async def download_media(self, file_id: str, file_name: str = None, progress=None):
+        from config import DOWNLOAD_DIR
+
+        entry = self.world.lookup(file_id)
+        await self.world.call("download_media", self.world.latency(entry, "download"))
+        if progress and entry and entry["size"]:
+            await progress(entry["size"], entry["size"])
+
+        # 生成空文件代替真实下载，Bot 上传后会删除
+        os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix="replay_", dir=DOWNLOAD_DIR)
+        os.close(fd)
+        self.world.files[path] = entry
+        return path
+
+
+class SimulatedBot:
+    """代替 MessageExtractorBot 中的 Bot 客户端
+
+    bot_rate 大于 0 时模拟 Bot 的全局限流：每秒调用超过该次数时抛出 FloodWait
+    """
+
+    def __init__(self, world: SimulatedWorld, bot_rate: int = 0):
+        self.world = world
+        self.bot_rate = bot_rate
+        self.recent_calls = deque()
+        self.last_message_id = 0
+
+    async def api(self, name: str, latency: float):
+        if self.bot_rate:
+            from pyrogram.errors import FloodWait
+
+            now = time.monotonic()
+            while self.recent_calls and now - self.recent_calls[0] > 1:
+                self.recent_calls.popleft()
+            if len(self.recent_calls) >= self.bot_rate:
+                self.world.calls["FloodWait"] += 1
+                raise FloodWait(value=1)
+            self.recent_calls.append(now)
+        await self.world.call(name, latency)
+
+    def sent(self, chat_id: int) -> SimulatedMessage:
+        self.last_message_id += 1
+        return SimulatedMessage(self, chat_id, self.last_message_id)
+
+    async def copy_from(self, name: str, chat_id: int, from_chat_id: int, message_id: int, count: int = 1):
+        item = self.world.messages.get((from_chat_id, message_id))
+        entry = item[0] if item else None
+        await self.api(name, self.world.latency(entry, "copy"))
+        if entry is None or entry["method"] not in COPYABLE_METHODS:
+            raise SimulatedRejection("CHAT_FORWARDS_RESTRICTED")
+        return [self.sent(chat_id) for _ in range(count)]
+
+    async def copy_message(self, chat_id: int, from_chat_id: int, message_id: int, **kwargs):
+        sent = await self.copy_from("copy_message", chat_id, from_chat_id, message_id)
+        return sent[0]
+
+    async def copy_media_group(self, chat_id: int, from_chat_id: int, message_id: int, captions=None, **kwargs):
+        item = self.world.messages.get((from_chat_id, message_id))
+        count = max(item[0]["count"], 1) if item else 1
+        return await self.copy_from("copy_media_group", chat_id, from_chat_id, message_id, count)
+
+    async def copy_messages(self, chat_id: int, from_chat_id: int, message_ids: list, **kwargs):
+        return await self.copy_from("copy_messages", chat_id, from_chat_id, message_ids[0], len(message_ids))
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await self.api("send_message", self.world.latency(None, "send"))
+        return self.sent(chat_id)
+
+    async def delete_messages(self, chat_id: int, message_ids, **kwargs):
+        await self.api("delete_messages", self.world.latency(None, "send"))
+        return True
+
+    def media_latency(self, media: str) -> float:
+        """按 file_id 发送或上传本地文件的耗时；file_id 不可用时抛出 SimulatedRejection"""
+        if media.startswith("sim:"):
+            entry = self.world.lookup(media)
+            if entry is None or entry["method"] not in FILE_ID_METHODS:
+                raise SimulatedRejection("FILE_REFERENCE_EXPIRED")
+            return self.world.latency(entry, "send")
+        entry = self.world.files.get(media)
+        # 录制的上传耗时是整组的平均值，相册中的每个文件按比例分摊
+        return self.world.latency(entry, "upload") / max(entry["count"], 1) if entry else DEFAULT_LATENCY
+
+    async def send_media(self, name: str, chat_id: int, media: str, progress=None):
+        try:
+            latency = self.media_latency(media)
+        except SimulatedRejection:
+            await self.api(name, self.world.latency(None, "send"))
+            raise
+        await self.api(name, latency)
+        if progress:
+            await progress(1, 1)
+        return self.sent(chat_id)
+
+    async def send_photo(self, chat_id: int, photo: str, progress=None, **kwargs):
+        return await self.send_media("send_photo", chat_id, photo, progress)
+
+    async def send_video(self, chat_id: int, video: str, progress=None, **kwargs):
+        return await self.send_media("send_video", chat_id, video, progress)
+
+    async def send_document(self, chat_id: int, document: str, progress=None, **kwargs):
+        return await self.send_media("send_document", chat_id, document, progress)
+
+    async def send_audio(self, chat_id: int, audio: str, progress=None, **kwargs):
+        return await self.send_media("send_audio", chat_id, audio, progress)
+
+    async def send_voice(self, chat_id: int, voice: str, progress=None, **kwargs):
+        return await self.send_media("send_voice", chat_id, voice, progress)
+
+    async def send_animation(self, chat_id: int, animation: str, progress=None, **kwargs):
+        return await self.send_media("send_animation", chat_id, animation, progress)
+
+    async def send_sticker(self, chat_id: int, sticker: str, **kwargs):
+        return await self.send_media("send_sticker", chat_id, sticker)
+
+    async def send_video_note(self, chat_id: int, video_note: str, **kwargs):
+        return await self.send_media("send_video_note", chat_id, video_note)
+
+    async def send_media_group(self, chat_id: int, media: list, **kwargs):
+        if len(media) > MEDIA_GROUP_LIMIT:
+            await self.api("send_media_group", self.world.latency(None, "send"))
+            raise SimulatedRejection("MULTI_MEDIA_TOO_LONG")
+        try:
+            latency = sum(self.media_latency(item.media) for item in media)
+        except SimulatedRejection:
+            await self.api("send_media_group", self.world.latency(None, "send"))
+            raise
+        await self.api("send_media_group", latency)
+        return [self.sent(chat_id) for _ in media]
+
+
+def load_entries(path: str, limit: int = 0) -> List[dict]:
+    """读取录制文件，按到达时间排序"""
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    entries.sort(key=lambda entry: entry["arrival"])
+    return entries[:limit] if limit else entries
+
+
+def percentile(values: List[float], ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * ratio), len(ordered) - 1)]
+
+
+def load_methods(path: str) -> Counter:
+    """统计一个记录文件中各转发方式的次数"""
+    with open(path, "r", encoding="utf-8") as f:
+        return Counter(json.loads(line)["method"] for line in f if line.strip())
+
+
+async def replay(entries: List[dict], speed: float, bot_rate: int, output: str) -> str:
+    """回放记录，返回报告文本"""
+    from bot_handler import MessageExtractorBot
+    from progress import format_size
+    from traffic import TrafficRecorder
+
+    world = SimulatedWorld(entries)
+    bot = MessageExtractorBot()
+    simulated_bot = SimulatedBot(world, bot_rate)
+    bot.bot = simulated_bot
+    bot.extractor.client = SimulatedUserClient(world)
+    # 回放结果按同样的格式记录，便于与录制文件对比转发方式和各阶段耗时
+    bot.recorder = TrafficRecorder(path=output)
+    bot.running = True
+
+    durations = []
+    peaks = {"jobs": 0, "download": 0, "waiting": 0}
+
+    async def monitor():
+        while True:
+            peaks["jobs"] = max(peaks["jobs"], len(bot.jobs.active))
+            peaks["download"] = max(peaks["download"], bot.admission.in_flight)
+            peaks["waiting"] = max(peaks["waiting"], bot.admission.waiting)
+            await asyncio.sleep(0.05)
+
+    monitor_task = asyncio.create_task(monitor())
+    tasks = []
+    first_arrival = entries[0]["arrival"]
+    started = time.monotonic()
+
+    for index, (entry, link) in enumerate(zip(entries, world.links)):
+        delay = (entry["arrival"] - first_arrival) / speed - (time.monotonic() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        # 同一录制用户映射为同一个虚拟用户，保持顺序阅读预取的行为
+        user_id = abs(hash(entry.get("user"))) % 10 ** 9
+        message = SimulatedMessage(simulated_bot, user_id, index + 1, text=link, user_id=user_id)
+        record = bot.recorder.begin(user_id, bot.extractor.parse_message_link(link))
+        task = bot.spawn_job(message, link, record)
+        task.add_done_callback(lambda _, arrived=time.monotonic(): durations.append(time.monotonic() - arrived))
+        tasks.append(task)
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.monotonic() - started
+    monitor_task.cancel()
+    await asyncio.to_thread(bot.recorder.close)
+
+    recorded_span = entries[-1]["arrival"] - first_arrival
+    cache = bot.extractor.cache
+    lookups = cache.hits + cache.misses
+    recorded_methods = Counter(entry["method"] for entry in entries)
+    replayed_methods = load_methods(output)
+
+    lines = [
+        f"回放 {len(entries)} 个请求，速度 {speed:g}x，耗时 {elapsed:.1f}s（录制时长 {recorded_span:.1f}s）",
+        f"吞吐量: {len(entries) / max(elapsed, 1e-3):.2f} 请求/秒",
+        f"请求耗时: p50 {percentile(durations, 0.5):.2f}s，p95 {percentile(durations, 0.95):.2f}s，"
+        f"最大 {max(durations):.2f}s",
+        f"最大并发任务: {peaks['jobs']}",
+        f"最大在途下载: {format_size(peaks['download'])}，最多排队 {peaks['waiting']} 个",
+        f"消息缓存命中率: {cache.hits * 100 / lookups:.0f}%（{cache.hits}/{lookups}）" if lookups else "消息缓存: 无查询",
+        "",
+        "模拟 API 调用:",
+    ]
+    lines += [f"  {name}: {count}" for name, count in world.calls.most_common()]
+    lines += ["", "转发方式（录制 → 回放）:"]
+    for method in sorted(set(recorded_methods) | set(replayed_methods), key=str):
+        lines.append(f"  {method}: {recorded_methods.get(method, 0)} → {replayed_methods.get(method, 0)}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的转发流量")
+    parser.add_argument("trace", help="TRAFFIC_RECORD_FILE 录制的 JSONL 文件")
+    parser.add_argument("--speed", type=float, default=1.0, help="到达间隔压缩倍数，默认 1")
+    parser.add_argument("--limit", type=int, default=0, help="最多回放的请求数，默认全部")
+    parser.add_argument("--bot-rate", type=int, default=0, help="模拟 Bot 每秒调用上限，默认不限")
+    parser.add_argument("--output", help="回放结果记录文件，默认写入临时文件")
+    args = parser.parse_args()
+
+    entries = load_entries(args.trace, args.limit)
+    if not entries:
+        print("记录文件为空")
+        sys.exit(1)
+
+    output = args.output
+    if output:
+        open(output, "w").close()
+    else:
+        fd, output = tempfile.mkstemp(prefix="replay_", suffix=".jsonl")
+        os.close(fd)
+
+    setup_logging()
+    setup_event_loop()
+    print(asyncio.run(replay(entries, args.speed, args.bot_rate, output)))
+    print(f"\n回放结果记录: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+运行时加速检测
+
+Pyrogram 在安装了 TgCrypto 时自动使用 C 实现的 AES-IGE，否则回退到纯 Python 的 pyaes；
+uvloop 需要在创建事件循环之前安装。这里负责按 ACCELERATED 配置选择事件循环、
+报告实际生效的后端，并提供加密吞吐量和事件循环开销的微基准。
+"""
+
+import os
+import time
+import asyncio
+import logging
+from importlib import metadata
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# AES 基准每次加密的数据块大小（必须是 16 的倍数）
+AES_CHUNK_SIZE = 64 * 1024
+
+
+def package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "?"
+
+
+def setup_event_loop() -> bool:
+    """加速模式下安装 uvloop 事件循环策略，需在 asyncio.run 之前调用
+
+    返回是否已启用 uvloop
+    """
+    try:
+        from config import ACCELERATED
+    except ValueError:
+        # 配置不完整时不启用，main() 中再次导入 config 时报告配置错误
+        return False
+    if not ACCELERATED:
+        return False
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+def detect_backends() -> Dict[str, str]:
+    """返回实际生效的加密后端和事件循环实现"""
+    from pyrogram.crypto import aes
+
+    # pyrogram.crypto.aes 导入成功 tgcrypto 时会保留该模块引用
+    if hasattr(aes, "tgcrypto"):
+        crypto = f"TgCrypto {package_version('TgCrypto')}"
+    else:
+        crypto = "pyaes（纯 Python）"
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is not None and type(loop).__module__.startswith("uvloop"):
+        event_loop = f"uvloop {package_version('uvloop')}"
+    else:
+        event_loop = "asyncio（默认）"
+
+    return {"crypto": crypto, "event_loop": event_loop}
+
+
+def log_backends():
+    """启动时记录运行时后端，未使用加速实现时给出警告"""
+    backends = detect_backends()
+    logger.info("运行时后端: 加密=%s, 事件循环=%s", backends["crypto"], backends["event_loop"])
+    if backends["crypto"].startswith("pyaes"):
+        logger.warning("未检测到 TgCrypto，大文件传输会受 CPU 限制，请安装 requirements-accel.txt")
+
+
+def benchmark_aes(duration: float = 1.0) -> float:
+    """测量 Pyrogram 当前使用的 AES-256-IGE 加密吞吐量（字节/秒）"""
+    from pyrogram.crypto import aes
+
+    data = os.urandom(AES_CHUNK_SIZE)
+    key = os.urandom(32)
+    iv = os.urandom(32)
+
+    processed = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        aes.ige256_encrypt(data, key, iv)
+        processed += AES_CHUNK_SIZE
+    return processed / (time.perf_counter() - started)
+
+
+async def benchmark_loop(iterations: int = 100000) -> Dict[str, float]:
+    """测量事件循环的调度开销（微秒/次）"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await asyncio.sleep(0)
+    yield_cost = (time.perf_counter() - started) / iterations * 1e6
+
+    async def noop():
+        pass
+
+    task_iterations = iterations // 10
+    started = time.perf_counter()
+    for _ in range(task_iterations):
+        await asyncio.create_task(noop())
+    task_cost = (time.perf_counter() - started) / task_iterations * 1e6
+
+    return {"yield_us": yield_cost, "task_us": task_cost}
+
+
+async def run_benchmark() -> str:
+    """运行全部微基准，返回报告文本"""
+    # progress 依赖 config，延迟导入使 setup_event_loop 可以在加载配置前调用
+    from progress import format_size
+
+    # AES 基准是 CPU 密集操作，放到线程中执行以免阻塞事件循环
+    aes_rate = await asyncio.to_thread(benchmark_aes)
+    loop_costs = await benchmark_loop()
+    backends = detect_backends()
+
+    return (
+        f"🔐 加密后端: {backends['crypto']}\n"
+        f"   AES-256-IGE 吞吐量: {format_size(aes_rate)}/s\n"
+        f"🔁 事件循环: {backends['event_loop']}\n"
+        f"   调度一次 (sleep(0)): {loop_costs['yield_us']:.2f}µs\n"
+        f"   创建并等待任务: {loop_costs['task_us']:.2f}µs"
+    )
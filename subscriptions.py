@@ -0,0 +1,98 @@
+import os
+import json
+import logging
+from typing import Dict, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionManager:
+    """频道订阅管理，订阅关系保存在 JSON 文件中
+
+    文件结构: {"频道ID": {"title": "频道名称", "subscribers": [用户聊天ID, ...]}}
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.channels: Dict[int, dict] = {}
+        self.load()
+
+    def load(self):
+        """从文件读取订阅关系"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.channels = {
+                int(channel_id): {"title": info.get("title", ""), "subscribers": set(info.get("subscribers", []))}
+                for channel_id, info in data.items()
+            }
+            logger.info("已加载 %s 个频道的订阅", len(self.channels))
+        except Exception as e:
+            logger.error("读取订阅文件失败: %s", e)
+
+    def save(self):
+        """写入订阅文件（先写临时文件再替换，避免写一半损坏）"""
+        data = {
+            str(channel_id): {"title": info["title"], "subscribers": sorted(info["subscribers"])}
+            for channel_id, info in self.channels.items()
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error("保存订阅文件失败: %s", e)
+
+    def subscribe(self, channel_id: int, title: str, subscriber: int) -> bool:
+        """添加订阅，已订阅时返回 False"""
+        info = self.channels.setdefault(channel_id, {"title": title, "subscribers": set()})
+        info["title"] = title or info["title"]
+        if subscriber in info["subscribers"]:
+            return False
+        info["subscribers"].add(subscriber)
+        self.save()
+        return True
+
+    def unsubscribe(self, channel_id: int, subscriber: int) -> bool:
+        """取消订阅，未订阅时返回 False"""
+        info = self.channels.get(channel_id)
+        if not info or subscriber not in info["subscribers"]:
+            return False
+        info["subscribers"].discard(subscriber)
+        if not info["subscribers"]:
+            del self.channels[channel_id]
+        self.save()
+        return True
+
+    def remove_subscriber(self, subscriber: int):
+        """移除用户的全部订阅（例如用户已屏蔽 Bot）"""
+        changed = False
+        for channel_id in list(self.channels):
+            info = self.channels[channel_id]
+            if subscriber in info["subscribers"]:
+                info["subscribers"].discard(subscriber)
+                changed = True
+                if not info["subscribers"]:
+                    del self.channels[channel_id]
+        if changed:
+            self.save()
+
+    def is_subscribed(self, channel_id: int) -> bool:
+        """频道是否有订阅者"""
+        return channel_id in self.channels
+
+    def subscribers(self, channel_id: int) -> Set[int]:
+        """频道的订阅者"""
+        info = self.channels.get(channel_id)
+        return set(info["subscribers"]) if info else set()
+
+    def user_subscriptions(self, subscriber: int) -> List[Tuple[int, str]]:
+        """用户订阅的频道列表 [(频道ID, 频道名称)]"""
+        return [
+            (channel_id, info["title"])
+            for channel_id, info in self.channels.items()
+            if subscriber in info["subscribers"]
+        ]
@@ -0,0 +1,180 @@
+"""
+转发流量录制
+
+设置 TRAFFIC_RECORD_FILE 后，每个链接请求结束时向该 JSONL 文件追加一条匿名记录，
+供 replay.py 离线回放。用户、聊天和消息ID 以加盐 HMAC 摘要保存，不记录链接和消息内容。
+
+记录字段:
+- arrival: 请求到达时间（Unix 时间戳）
+- user / chat / message: 用户ID、链接中的来源聊天、来源消息的摘要
+- media / count / size: 首条消息的媒体类型、消息数量、整组文件总字节数
+- method: 最终成功的转发方式（lean、copy、text、file_id、download、album_copy、
+  album_file_id、album_download、per_message），未成功时为 null
+- stages: 各阶段的调用次数、失败次数和累计耗时（秒）
+- total: 请求总耗时（秒）
+- outcome: ok、not_found、aborted 或 error
+"""
+
+import os
+import hmac
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+from contextvars import ContextVar
+from typing import List, Optional
+
+from config import TRAFFIC_RECORD_FILE, TRAFFIC_SALT
+
+logger = logging.getLogger(__name__)
+
+# 当前任务正在记录的请求；asyncio 任务创建时复制上下文，子任务的调用也会记入
+current_record: ContextVar[Optional[dict]] = ContextVar("traffic_record", default=None)
+
+
+def note_messages(messages: List):
+    """记录请求解析出的来源消息"""
+    record = current_record.get()
+    if record is None or not messages:
+        return
+    first = messages[0]
+    record["media"] = first.media or ("text" if first.text else None)
+    record["count"] = len(messages)
+    record["size"] = sum(msg.file_size or 0 for msg in messages)
+
+
+def note_method(method: str):
+    """记录最终成功的转发方式"""
+    record = current_record.get()
+    if record is not None:
+        record["method"] = method
+
+
+def note_stage(stage: str, elapsed: float, ok: bool):
+    """记录一次阶段调用的耗时"""
+    record = current_record.get()
+    if record is None:
+        return
+    stats = record["stages"].setdefault(stage, {"calls": 0, "errors": 0, "seconds": 0.0})
+    stats["calls"] += 1
+    stats["seconds"] += elapsed
+    if not ok:
+        stats["errors"] += 1
+
+
+class TrafficRecorder:
+    """把每个请求的匿名记录追加到 JSONL 文件
+
+    与日志管道相同，记录放入队列后由后台线程写入文件，请求结束时不在事件循环中做磁盘 IO。
+    停止时调用 close() 写完队列中剩余的记录。
+    """
+
+    def __init__(self, path: str = TRAFFIC_RECORD_FILE, salt: str = TRAFFIC_SALT):
+        self.path = path
+        # 未设置盐时每次启动随机生成，不同次运行的摘要无法相互关联
+        self.salt = (salt or os.urandom(16).hex()).encode()
+        self.queue: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+        self.writer: Optional[threading.Thread] = None
+        self.writer_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def anonymize(self, value) -> Optional[str]:
+        if value is None:
+            return None
+        return hmac.new(self.salt, str(value).lower().encode(), hashlib.sha256).hexdigest()[:16]
+
+    def begin(self, user_id: Optional[int], parsed_link: Optional[dict]) -> Optional[dict]:
+        """请求到达时调用，返回新记录（未开启录制时返回 None）
+
+        parsed_link 为 MessageExtractor.parse_message_link 的结果，链接无效时为 None
+        """
+        if not self.enabled:
+            return None
+        parsed_link = parsed_link or {}
+        record = {
+            "arrival": time.time(),
+            "started": time.monotonic(),
+            "user_id": user_id,
+            "chat_id": parsed_link.get("chat_id"),
+            "message_id": parsed_link.get("message_id"),
+            "media": None,
+            "count": 0,
+            "size": 0,
+            "method": None,
+            "stages": {},
+        }
+        return record
+
+    @staticmethod
+    def attach(record: Optional[dict]):
+        """在处理请求的任务中调用，之后的阶段耗时和转发方式记入该记录"""
+        current_record.set(record)
+
+    def finish(self, outcome: str):
+        """请求结束时调用，写入当前上下文中的记录"""
+        record = current_record.get()
+        if record is None:
+            return
+        current_record.set(None)
+
+        entry = {
+            "arrival": round(record["arrival"], 3),
+            "user": self.anonymize(record["user_id"]),
+            "chat": self.anonymize(record["chat_id"]),
+            "message": self.anonymize(f"{record['chat_id']}/{record['message_id']}"),
+            "media": record["media"],
+            "count": record["count"],
+            "size": record["size"],
+            "method": record["method"],
+            "stages": {
+                stage: {**stats, "seconds": round(stats["seconds"], 3)}
+                for stage, stats in record["stages"].items()
+            },
+            "total": round(time.monotonic() - record["started"], 3),
+            "outcome": outcome,
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self.writer_lock:
+            if self.writer is None:
+                self.writer = threading.Thread(
+                    target=self.write_loop, args=(self.queue,), name="traffic-recorder", daemon=True
+                )
+                self.writer.start()
+            self.queue.put(line)
+
+    def write_loop(self, lines_queue: "queue.SimpleQueue[Optional[str]]"):
+        """后台线程：按到达顺序追加记录，收到 None 时退出"""
+        while True:
+            lines = [lines_queue.get()]
+            # 一次写入队列中已有的全部记录
+            while lines[-1] is not None:
+                try:
+                    lines.append(lines_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = lines[-1] is None
+            lines = [line for line in lines if line is not None]
+            if lines:
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.writelines(lines)
+                except Exception as e:
+                    logger.warning("写入流量记录失败: %s", e)
+            if stop:
+                return
+
+    def close(self):
+        """写完队列中的记录并停止后台线程（会阻塞，在事件循环中请用 asyncio.to_thread 调用）"""
+        with self.writer_lock:
+            writer, self.writer = self.writer, None
+            if writer is None:
+                return
+            # 之后的记录进入新队列，由新的后台线程写入
+            self.queue.put(None)
+            self.queue = queue.SimpleQueue()
+        writer.join()